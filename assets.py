@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+from datetime import datetime, timezone
+
+from flask import request, send_from_directory
+from PIL import Image
+
+try:
+    import brotli   # optional, without it only .gz siblings are written
+except ImportError:
+    brotli = None
+
+
+# Folders under static/ that go through the build, uploads and the CKEditor bundle are served as they are
+ASSET_DIRS = ["assets", "css", "js"]
+DIST_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".ico"}
+REENCODE = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+MAX_IMAGE_WIDTH = 1920   # backgrounds never render wider than this
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _hashed_name(logical_name, content):
+    stem, ext = os.path.splitext(logical_name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{DIST_DIR}/{stem}.{digest}{ext}"
+
+
+def _write(static_folder, name, content):
+    path = os.path.join(static_folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _reencode_image(content, save_format):
+    """Downsizes oversized images, returns the optimized original format and a WebP copy"""
+    with Image.open(io.BytesIO(content)) as image:
+        if image.width > MAX_IMAGE_WIDTH:
+            image.thumbnail((MAX_IMAGE_WIDTH, MAX_IMAGE_WIDTH * image.height // image.width), Image.LANCZOS)
+        if save_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        optimized, webp = io.BytesIO(), io.BytesIO()
+        image.save(optimized, save_format, optimize=True, **({"quality": 82} if save_format == "JPEG" else {}))
+        image.save(webp, "WEBP", quality=80, method=6)
+
+    # Keep the source if re-encoding did not make it smaller
+    optimized = optimized.getvalue()
+    return (optimized if len(optimized) < len(content) else content), webp.getvalue()
+
+
+def build_assets(static_folder):
+    """Writes fingerprinted, precompressed copies of the static assets and returns the manifest"""
+
+    manifest = {}
+    for asset_dir in ASSET_DIRS:
+        for root, _, files in os.walk(os.path.join(static_folder, asset_dir)):
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                logical_name = os.path.relpath(path, static_folder).replace(os.sep, "/")
+                ext = os.path.splitext(file)[1].lower()
+
+                with open(path, "rb") as f:
+                    content = f.read()
+
+                entry = {}
+                if ext in REENCODE:
+                    content, webp = _reencode_image(content, REENCODE[ext])
+                    entry["webp"] = _hashed_name(os.path.splitext(logical_name)[0] + ".webp", webp)
+                    _write(static_folder, entry["webp"], webp)
+
+                entry["file"] = _hashed_name(logical_name, content)
+                _write(static_folder, entry["file"], content)
+
+                if ext in COMPRESSIBLE:
+                    entry["encodings"] = ["gzip"]
+                    _write(static_folder, entry["file"] + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+                    if brotli is not None:
+                        entry["encodings"].insert(0, "br")
+                        _write(static_folder, entry["file"] + ".br", brotli.compress(content))
+
+                manifest[logical_name] = entry
+
+    _write(static_folder, f"{DIST_DIR}/{MANIFEST_NAME}", json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetManifest:
+    """Resolves url_for('static', ...) through the build manifest and serves the built files"""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.built = {}   # hashed file name -> manifest entry
+        self.version = ""      # digest of the manifest, changes whenever a build renames an asset
+        self.built_at = None   # when that build was written
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.load()
+        app.url_defaults(self.resolve_static_url)
+        self._send_static_file = app.view_functions["static"]
+        app.view_functions["static"] = self.send_asset
+
+    def load(self):
+        # Without a build the app keeps serving the original files
+        path = os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+            self.built_at = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        except (OSError, ValueError):
+            self.manifest, self.built_at = {}, None
+        self.built = {entry["file"]: entry for entry in self.manifest.values()}
+        self.version = hashlib.sha1(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:12] \
+            if self.manifest else ""
+
+    def resolve_static_url(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]["file"]
+
+    def send_asset(self, filename):
+        entry = self.built.get(filename)
+        if entry is None:
+            return self._send_static_file(filename=filename)
+
+        served_name, encoding = filename, None
+        mimetype = mimetypes.guess_type(filename)[0]
+
+        # Images: only clients that explicitly list WebP get it, background images included
+        if "webp" in entry and any(mime == "image/webp" for mime, quality in request.accept_mimetypes if quality):
+            served_name, mimetype = entry["webp"], "image/webp"
+
+        for candidate in entry.get("encodings", []):
+            if request.accept_encodings[candidate]:
+                served_name, encoding = f"{filename}.{'br' if candidate == 'br' else 'gz'}", candidate
+                break
+
+        response = send_from_directory(self.static_folder, served_name, mimetype=mimetype, max_age=31536000)
+        response.headers["Cache-Control"] = IMMUTABLE
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if "webp" in entry or "encodings" in entry:
+            response.vary.add("Accept" if "webp" in entry else "Accept-Encoding")
+        return response
@@ -0,0 +1,248 @@
+"""
+Load and latency benchmark for every route, against a throwaway SQLite database.
+
+    python bench_routes.py --posts 2000 --requests 200                    # Flask test client, in process
+    python bench_routes.py --server --workers 4 --concurrency 8           # real gunicorn process over HTTP
+    python bench_routes.py --output run.json --baseline baseline.json     # fail if p95 regressed
+
+Reports requests/second and p50/p95/p99 latency per route. Contact messages go to the stub email transport.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ADMIN_EMAIL = "bench@example.com"
+ADMIN_PASSWORD = "bench-password"
+
+
+def seed(db_uri, posts, images_per_post):
+    """Fills a fresh database, run in a child process so the app is configured for db_uri"""
+    code = f"""
+import main
+from datetime import date, timedelta
+from werkzeug.security import generate_password_hash
+app, db = main.app, main.db
+with app.app_context():
+    db.create_all()
+    main.search_index.create_schema()
+    db.session.add(main.User(name="bench", email={ADMIN_EMAIL!r},
+                             password=generate_password_hash({ADMIN_PASSWORD!r}, method="scrypt", salt_length=10)))
+    body = "<p>" + "Benchmark project body text with <b>some</b> markup. " * 80 + "</p>"
+    for start in range(0, {posts}, 500):
+        batch = []
+        for i in range(start, min(start + 500, {posts})):
+            project = main.ProjectPosts(title=f"Project {{i}}", subtitle=f"Subtitle {{i}}", body=body,
+                                        img_url="https://example.com/card.jpg",
+                                        date=date(2020, 1, 1) + timedelta(days=i % 2000))
+            for j in range({images_per_post}):
+                project.images.append(main.ProjectImage(image_file=f"bench-{{i}}-{{j}}.jpg", image_description="bench"))
+            batch.append(project)
+        db.session.add_all(batch)
+        db.session.commit()
+    main.search_index.rebuild(main.ProjectPosts)
+"""
+    subprocess.run([sys.executable, "-c", code], env=bench_env(db_uri), check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_env(db_uri):
+    # Rate limits off, otherwise login and contact would only measure the 429 path, and no access log lines
+    return dict(os.environ, DB_URI=db_uri, FLASK_KEY=os.environ.get("FLASK_KEY", "bench"), EMAIL_TRANSPORT="stub",
+                RATE_LIMITS_ENABLED="0", ACCESS_LOG="0")
+
+
+def route_plan(posts, pages):
+    """(name, method, path, form) for every route, GETs spread over pages and projects"""
+    return [
+        ("home", "GET", lambda: "/", None),
+        ("projects", "GET", lambda: f"/projects?page={random.randint(1, pages)}", None),
+        ("projects_cursor", "GET", lambda: "/projects", None),
+        ("show_project", "GET", lambda: f"/project/{random.randint(1, posts)}", None),
+        ("search", "GET", lambda: "/search?q=benchmark", None),
+        ("resume", "GET", lambda: "/resume", None),
+        ("about", "GET", lambda: "/about", None),
+        ("sitemap", "GET", lambda: "/sitemap.xml", None),
+        ("feed", "GET", lambda: "/feed.xml", None),
+        ("contact", "POST", lambda: "/contact",
+         {"name": "Bench", "email": "bench@example.com", "phone": "123", "message": "Benchmark message"}),
+        ("login", "POST", lambda: "/login", {"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}),
+    ]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+    }
+
+
+def run_test_client(db_uri, plan, requests_per_route):
+    os.environ.update(bench_env(db_uri))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    main.app.config["WTF_CSRF_ENABLED"] = False
+    client = main.app.test_client()
+
+    results = {}
+    for name, method, path, form in plan:
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(requests_per_route):
+            before = time.perf_counter()
+            response = client.open(path(), method=method, data=form)
+            latencies.append(time.perf_counter() - before)
+            errors += response.status_code >= 400
+        results[name] = summarize(latencies, time.perf_counter() - started, errors)
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def csrf_token(opener, url):
+    page = opener.open(url).read().decode()
+    match = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+    return match.group(1) if match else ""
+
+
+def run_server(db_uri, plan, requests_per_route, workers, concurrency):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "main:app"],
+        env=bench_env(db_uri), cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + "/about", timeout=1)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+
+        results = {}
+        for name, method, path, form in plan:
+            latencies, errors, lock = [], [0], threading.Lock()
+            per_thread = max(requests_per_route // concurrency, 1)
+
+            def worker():
+                # Each thread is one visitor with its own cookies, POSTs fetch a CSRF token first (not timed)
+                opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+                for _ in range(per_thread):
+                    url = base + path()
+                    data = None
+                    if form is not None:
+                        data = urllib.parse.urlencode(dict(form, csrf_token=csrf_token(opener, url))).encode()
+                    before = time.perf_counter()
+                    try:
+                        opener.open(url, data=data, timeout=30).read()
+                        failed = False
+                    except urllib.error.HTTPError as e:
+                        failed = e.code >= 400
+                    except OSError:
+                        failed = True
+                    elapsed = time.perf_counter() - before
+                    with lock:
+                        latencies.append(elapsed)
+                        errors[0] += failed
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, time.perf_counter() - started, errors[0])
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def compare(results, baseline, tolerance):
+    """Routes whose p95 got slower than the baseline by more than tolerance (0.2 = 20%)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("routes", {}).get(name)
+        if previous and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--images-per-post", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--server", action="store_true", help="run against a real gunicorn process")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against an earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_uri = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seed(db_uri, args.posts, args.images_per_post)
+        plan = route_plan(args.posts, pages=max(args.posts // 5, 1))
+
+        if args.server:
+            results = run_server(db_uri, plan, args.requests, args.workers, args.concurrency)
+        else:
+            results = run_test_client(db_uri, plan, args.requests)
+
+    print(f"{'route':<16}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['throughput_rps']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['errors']:>8}")
+
+    report = {
+        "mode": "gunicorn" if args.server else "test_client",
+        "posts": args.posts,
+        "images_per_post": args.images_per_post,
+        "requests_per_route": args.requests,
+        "routes": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("mode") != report["mode"]:
+            print(f"Warning: baseline was a {baseline.get('mode')} run, this is a {report['mode']} run")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
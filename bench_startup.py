@@ -0,0 +1,57 @@
+"""
+Measures how long a fresh worker takes to import main.py and serve its first request.
+
+    python bench_startup.py --runs 10
+    python bench_startup.py --path /path/to/other/checkout   # compare against another version
+
+Each run is a new interpreter, like a gunicorn worker booting, against a throwaway SQLite database.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+RUN_ONCE = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.app
+with app.app_context():
+    main.db.create_all()
+ready = time.perf_counter()
+response = app.test_client().get("/about")
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_request": served - ready, "status": response.status_code}))
+"""
+
+
+def run_once(path, db_uri):
+    env = dict(os.environ, DB_URI=db_uri, FLASK_KEY=os.environ.get("FLASK_KEY", "bench"))
+    result = subprocess.run([sys.executable, "-c", RUN_ONCE], cwd=path, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default=os.path.dirname(os.path.abspath(__file__)))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_uri = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        run_once(args.path, db_uri)   # warm the OS file cache and create the schema once
+        runs = [run_once(args.path, db_uri) for _ in range(args.runs)]
+
+    for key in ("import", "first_request"):
+        values = [run[key] * 1000 for run in runs]
+        print(f"{key:>14}: median {statistics.median(values):7.1f} ms   min {min(values):7.1f} ms   max {max(values):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import tarfile
+import tempfile
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from werkzeug.utils import secure_filename
+
+from migrations import parse_legacy_date
+
+
+# Archive layout: the upload blobs first, then one JSON line per post with its images
+UPLOADS_PREFIX = "uploads/"
+PROJECTS_MEMBER = "projects.jsonl"
+
+
+def tar_mode(path, writing):
+    if writing:
+        return "w|gz" if path.endswith((".gz", ".tgz")) else "w|"
+    return "r|*"   # stream mode, the compression is detected from the file
+
+
+def post_record(post):
+    return {
+        "title": post.title,
+        "subtitle": post.subtitle,
+        "body": post.body,
+        "img_url": post.img_url,
+        "date": post.date,
+        "published_on": post.published_on.isoformat() if post.published_on else None,
+        "created_at": post.created_at.isoformat() if post.created_at else None,
+        "updated_at": post.updated_at.isoformat() if post.updated_at else None,
+        # Variants are not exported, the image worker rebuilds them after an import
+        "images": [{"image_file": image.image_file, "image_description": image.image_description}
+                   for image in post.images],
+    }
+
+
+def export_archive(db, post_model, image_model, storage, path, batch_size=500):
+    """Streams every post and the upload files it references into a tar archive, returns (posts, files)"""
+
+    files = 0
+    with tarfile.open(path, tar_mode(path, writing=True)) as tar:
+        referenced = db.session.execute(
+            select(image_model.image_file).distinct().order_by(image_model.image_file)
+            .execution_options(yield_per=batch_size)
+        ).scalars()
+        for filename in referenced:
+            if not storage.exists(filename):
+                continue
+            info = tarfile.TarInfo(UPLOADS_PREFIX + filename)
+            info.size = storage.size(filename)
+            info.mtime = int(datetime.now().timestamp())
+            with storage.open(filename) as f:
+                tar.addfile(info, f)
+            files += 1
+
+        # A tar member needs its size up front, so the lines are spooled to a temp file first
+        posts, last_id = 0, 0
+        with tempfile.TemporaryFile() as spool:
+            while True:
+                batch = db.session.execute(
+                    select(post_model).options(selectinload(post_model.images))
+                    .where(post_model.id > last_id).order_by(post_model.id).limit(batch_size)
+                ).scalars().all()
+                if not batch:
+                    break
+                for post in batch:
+                    spool.write(json.dumps(post_record(post)).encode() + b"\n")
+                posts += len(batch)
+                last_id = batch[-1].id
+                db.session.expunge_all()
+
+            info = tarfile.TarInfo(PROJECTS_MEMBER)
+            info.size = spool.tell()
+            info.mtime = int(datetime.now().timestamp())
+            spool.seek(0)
+            tar.addfile(info, spool)
+
+    return posts, files
+
+
+def restore_upload(tar, member, storage):
+    # Names are content hashes, a file that already exists holds the same bytes
+    filename = secure_filename(os.path.basename(member.name))
+    if not filename or storage.exists(filename):
+        return False
+    storage.save(filename, tar.extractfile(member))
+    return True
+
+
+def import_posts(db, post_model, image_model, lines, batch_size, on_created=None):
+    """Adds the posts whose title is not in the database yet, one committed batch at a time"""
+
+    imported, skipped = 0, 0
+
+    def flush(records):
+        nonlocal imported, skipped
+        titles = [record["title"] for record in records]
+        existing = set(db.session.execute(select(post_model.title).where(post_model.title.in_(titles))).scalars())
+
+        created = []
+        for record in records:
+            if record["title"] in existing:
+                skipped += 1
+                continue
+            existing.add(record["title"])   # a title repeated inside the archive is imported once
+
+            # Rows exported before migrate-dates only have the old string, an unparsable one stays NULL for
+            # migrate-dates to report instead of turning into the import date
+            if record["published_on"]:
+                published_on = date.fromisoformat(record["published_on"])
+            else:
+                published_on = parse_legacy_date(record["date"])
+            post = post_model(title=record["title"], subtitle=record["subtitle"], body=record["body"],
+                              img_url=record["img_url"], date=published_on or date.today())
+            post.published_on = published_on
+            post.date = record["date"] or post.date
+            if record["created_at"]:
+                post.created_at = datetime.fromisoformat(record["created_at"])
+            if record["updated_at"]:
+                post.updated_at = datetime.fromisoformat(record["updated_at"])
+            for image in record["images"]:
+                post.images.append(image_model(image_file=image["image_file"],
+                                               image_description=image["image_description"]))
+            db.session.add(post)
+            created.append(post)
+
+        db.session.flush()
+        if on_created:
+            for post in created:
+                on_created(post)
+        imported += len(created)
+        db.session.commit()
+        db.session.expunge_all()
+
+    batch = []
+    for line in lines:
+        if line.strip():
+            batch.append(json.loads(line))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return imported, skipped
+
+
+def import_archive(db, post_model, image_model, storage, path, batch_size=200, on_created=None):
+    """Restores an export_archive() file, existing titles are skipped, returns (imported, skipped, files)"""
+
+    files, imported, skipped = 0, 0, 0
+    with tarfile.open(path, tar_mode(path, writing=False)) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if member.name.startswith(UPLOADS_PREFIX):
+                files += restore_upload(tar, member, storage)
+            elif member.name == PROJECTS_MEMBER:
+                # Read line by line straight from the archive stream, json.loads takes the raw bytes
+                imported, skipped = import_posts(db, post_model, image_model, tar.extractfile(member),
+                                                 batch_size, on_created)
+    return imported, skipped, files
@@ -0,0 +1,92 @@
+import hashlib
+from datetime import timezone
+from functools import wraps
+
+from flask import g, request, session, make_response
+from flask_login import current_user
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from outbox import utcnow
+
+
+class RevisionStore:
+    """Revision counters shared by every worker through the database"""
+
+    def __init__(self, db=None, model=None, deploy=None):
+        self.db = db
+        self.model = model
+        # () -> (version, deployed_at or None), a new deploy changes every validator without a content write
+        self.deploy = deploy or (lambda: ("", None))
+
+    def init_app(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get(self, names):
+        # A primary key lookup on a tiny table, no ORM objects are built
+        rows = self.db.session.execute(
+            select(self.model.name, self.model.revision, self.model.updated_at).where(self.model.name.in_(names))
+        ).all()
+        return {name: (revision, updated_at) for name, revision, updated_at in rows}
+
+    def bump(self, *names):
+        session = self.db.session
+        for name in names:
+            bump = update(self.model).where(self.model.name == name).values(
+                revision=self.model.revision + 1, updated_at=utcnow()
+            )
+            if session.execute(bump).rowcount == 0:
+                session.add(self.model(name=name, revision=1, updated_at=utcnow()))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another worker created the row first, bump that one instead
+                session.rollback()
+                session.execute(bump)
+                session.commit()
+
+
+def conditional(store, names):
+    """ETag/Last-Modified from the named revisions, unchanged pages get a 304 before the view runs.
+    names is a list or a function of the view args, e.g. lambda project_id: [f"project:{project_id}"]"""
+
+    def decorator(func):
+        @wraps(func)
+        def decorator_function(*args, **kwargs):
+            # Pending flash messages make the page different from the cached copy
+            if request.method != "GET" or "_flashes" in session:
+                return func(*args, **kwargs)
+
+            revision_names = names(**kwargs) if callable(names) else names
+            revisions = store.get(revision_names)
+            if len(revisions) != len(revision_names):
+                return func(*args, **kwargs)   # nothing written yet (or a missing page), no validator to offer
+
+            # The page also depends on the deployed code and assets, the URL and the login state
+            version, deployed_at = store.deploy()
+            content = ",".join([f"{name}={revisions[name][0]}" for name in sorted(revision_names)] + [version])
+            key = "|".join([content, request.full_path, str(current_user.is_authenticated)])
+            etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+            # The page cache keys on the same revisions and deploy, so a worker that missed an eviction (or a
+            # shared cache written by the previous deploy) never pairs this ETag with an older body
+            g.content_revisions = content
+            last_modified = max([updated_at.replace(tzinfo=timezone.utc) for _, updated_at in revisions.values()] +
+                                ([deployed_at] if deployed_at else []))
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = request.if_modified_since is not None and \
+                    last_modified.replace(microsecond=0) <= request.if_modified_since
+
+            response = make_response("", 304) if not_modified else make_response(func(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                # Browsers keep the page but check back every time, which is now a cheap 304
+                response.cache_control.no_cache = True
+                response.vary.add("Cookie")
+            return response
+        return decorator_function
+    return decorator
@@ -0,0 +1,121 @@
+import threading
+from datetime import timezone
+from xml.sax.saxutils import escape
+
+from flask import url_for
+from sqlalchemy import select
+
+
+SITEMAP_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+SITEMAP_TAIL = "</urlset>\n"
+ATOM_TAIL = "</feed>\n"
+
+
+def iso(value):
+    return value.replace(tzinfo=timezone.utc).isoformat() if value else None
+
+
+class FeedCache:
+    """sitemap.xml and the Atom feed as prebuilt bytes, only posts changed since the last build are re-rendered"""
+
+    def __init__(self, revisions, model, site_url, static_pages=(), entries=20, batch_size=500):
+        self.revisions = revisions
+        self.model = model
+        # Absolute URLs come from the configured site, never from the Host header of whoever asked first
+        self.site_url = site_url.rstrip("/")
+        self.static_pages = static_pages   # endpoints listed in the sitemap next to the posts
+        self.entries = entries             # newest posts in the feed
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._fragments = {}   # post id -> (updated_at, sitemap <url>)
+        self._entries = {}     # post id -> (updated_at, atom <entry>), only the newest posts the feed shows
+        self._built = None     # revision the bytes below were built for
+        self._sitemap = self._atom = b""
+
+    def sitemap(self):
+        self._refresh()
+        return self._sitemap
+
+    def atom(self):
+        self._refresh()
+        return self._atom
+
+    def _refresh(self):
+        # Every write bumps the "global" revision, so any worker notices a change with one primary key lookup
+        revision = self.revisions.get(["global"]).get("global", (0, None))[0]
+        if self._built == revision:
+            return
+        with self._lock:
+            if self._built != revision:
+                self._build()
+                self._built = revision
+
+    def _url(self, endpoint, **values):
+        return escape(self.site_url + url_for(endpoint, **values))
+
+    def _sitemap_url(self, row):
+        lastmod = iso(row.updated_at or row.created_at)
+        return (f"<url><loc>{self._url('main.show_project', project_id=row.id)}</loc>"
+                + (f"<lastmod>{lastmod}</lastmod>" if lastmod else "") + "</url>\n")
+
+    def _atom_entry(self, row):
+        link = self._url("main.show_project", project_id=row.id)
+        published = iso(row.created_at) or iso(row.updated_at) or "1970-01-01T00:00:00+00:00"
+        return (f"<entry><title>{escape(row.title)}</title>"
+                f'<link rel="alternate" href="{link}"/><id>{link}</id>'
+                f"<published>{published}</published><updated>{iso(row.updated_at) or published}</updated>"
+                f"<summary>{escape(row.excerpt or row.subtitle)}</summary></entry>\n")
+
+    def _build(self):
+        model = self.model
+        session = self.revisions.db.session
+
+        # Only ids and timestamps are streamed for the whole table, posts whose timestamp moved are re-rendered
+        order, stale = [], []
+        listing = session.execute(
+            select(model.id, model.updated_at)
+            .order_by(model.published_on.desc(), model.id.desc())
+            .execution_options(yield_per=self.batch_size)
+        )
+        for post_id, updated_at in listing:
+            order.append(post_id)
+            in_feed = len(order) <= self.entries
+            for fragments in (self._fragments, self._entries) if in_feed else (self._fragments,):
+                cached = fragments.get(post_id)
+                if cached is None or cached[0] != updated_at:
+                    stale.append(post_id)
+                    break
+
+        in_feed = set(order[:self.entries])
+        for start in range(0, len(stale), self.batch_size):
+            rows = session.execute(
+                select(model.id, model.title, model.subtitle, model.excerpt, model.published_on,
+                       model.created_at, model.updated_at)
+                .where(model.id.in_(stale[start:start + self.batch_size]))
+            ).all()
+            for row in rows:
+                self._fragments[row.id] = (row.updated_at, self._sitemap_url(row))
+                if row.id in in_feed:
+                    self._entries[row.id] = (row.updated_at, self._atom_entry(row))
+
+        # Deleted posts drop out here, and posts pushed out of the feed by newer ones
+        self._fragments = {post_id: self._fragments[post_id] for post_id in order if post_id in self._fragments}
+        self._entries = {post_id: self._entries[post_id] for post_id in in_feed if post_id in self._entries}
+
+        pages = "".join(f"<url><loc>{self._url(endpoint)}</loc></url>\n"
+                        for endpoint in self.static_pages)
+        self._sitemap = "".join(
+            [SITEMAP_HEAD, pages] + [fragment[1] for fragment in self._fragments.values()] + [SITEMAP_TAIL]
+        ).encode()
+
+        newest = [self._entries[post_id] for post_id in order[:self.entries] if post_id in self._entries]
+        updated = max((iso(entry[0]) for entry in newest if entry[0]), default=None)
+        home = self._url("main.home")
+        head = ('<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">\n'
+                f"<title>John Temitope | Projects</title><id>{home}</id>"
+                f'<link rel="alternate" href="{home}"/>'
+                f'<link rel="self" href="{self._url("main.atom_feed")}"/>'
+                f"<updated>{updated or '1970-01-01T00:00:00+00:00'}</updated>"
+                "<author><name>John Temitope</name></author>\n")
+        self._atom = "".join([head] + [entry[1] for entry in newest] + [ATOM_TAIL]).encode()
@@ -0,0 +1,13 @@
+# Loaded automatically by gunicorn from the working directory.
+# The app is imported once in the master and forked into the workers, so a worker boot costs only the fork.
+# No threads that use the database run in the master, a fork can copy a lock one of them holds.
+# The outbox, keep-alive and upload GC threads run in their own process, see `flask run-workers` in the Procfile.
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers
+    import main
+
+    with main.app.app_context():
+        main.db.engine.dispose(close=False)
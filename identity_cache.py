@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+
+def credential_stamp(user):
+    # Changes whenever the password hash, email or name changes, so old sessions stop matching
+    return hashlib.sha256(f"{user.password}|{user.email}|{user.name}".encode()).hexdigest()[:16]
+
+
+class CachedUser(UserMixin):
+    """Plain copy of a User row, reading it never touches the database"""
+
+    def __init__(self, id, name, email, stamp):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.stamp = stamp
+
+    def get_id(self):
+        return f"{self.id}:{self.stamp}"
+
+
+class IdentityCache:
+    """Short TTL cache of logged-in identities keyed by (user id, credential stamp)"""
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl   # bounds how long another worker can keep serving a changed user
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id, fetch_user):
+        """session_id is what Flask-Login stored ("<id>:<stamp>"), fetch_user loads the row by id"""
+        user_id, _, stamp = session_id.partition(":")
+        if not user_id.isdigit():
+            return None
+        key = (int(user_id), stamp)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        user = fetch_user(int(user_id))
+        if user is None:
+            return None
+
+        current_stamp = credential_stamp(user)
+        # Sessions from before the stamp existed carry only the id, they are accepted but not cached
+        if not stamp:
+            return user
+        if stamp != current_stamp:
+            return None   # password or account changed since this session logged in
+
+        identity = CachedUser(user.id, user.name, user.email, current_stamp)
+        with self._lock:
+            self._entries[key] = (identity, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, user_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
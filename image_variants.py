@@ -0,0 +1,132 @@
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+from sqlalchemy import select
+
+
+# Target widths for the responsive variants, images are never upscaled
+VARIANT_WIDTHS = {
+    "thumb": 320,
+    "medium": 800,
+    "full": 1600,
+}
+
+# Pillow format for each original extension, anything else is re-encoded as JPEG
+SAVE_FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".webp": "WEBP",
+}
+
+
+def variant_filename(filename, label, ext):
+    stem = os.path.splitext(filename)[0]
+    return f"variants/{stem}_{label}{ext}"
+
+
+def build_variants(storage, filename):
+    """Writes the downsized and WebP copies of an upload, returns the metadata stored on ProjectImage"""
+
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in SAVE_FORMATS:
+        ext = ".jpg"
+    save_format = SAVE_FORMATS[ext]
+
+    # Object store bodies cannot seek, so the original is read into memory (uploads are capped by MAX_UPLOAD_MB)
+    with storage.open(filename) as f:
+        content = io.BytesIO(f.read())
+
+    with Image.open(content) as original:
+        original = ImageOps.exif_transpose(original)   # phone photos carry their rotation in EXIF
+        width, height = original.size
+        variants = {"width": width, "height": height, "sizes": []}
+
+        for label, target_width in VARIANT_WIDTHS.items():
+            # Once a variant reaches the original width the bigger ones would just be copies of it
+            if variants["sizes"] and variants["sizes"][-1]["width"] >= width:
+                break
+
+            resized = original.copy()
+            resized.thumbnail((target_width, target_width * height // max(width, 1)), Image.LANCZOS)
+            if save_format == "JPEG" and resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+
+            encoded, webp = io.BytesIO(), io.BytesIO()
+            resized.save(encoded, save_format, quality=82, optimize=True)
+            resized.save(webp, "WEBP", quality=80, method=4)
+            encoded.seek(0)
+            webp.seek(0)
+            storage.save(variant_filename(filename, label, ext), encoded)
+            storage.save(variant_filename(filename, label, ".webp"), webp)
+
+            variants["sizes"].append({"label": label, "ext": ext, "width": resized.width, "height": resized.height})
+
+    return variants
+
+
+def remove_variants(storage, filename):
+    """Deletes every variant an upload may have, returns the bytes freed"""
+    freed = 0
+    for label in VARIANT_WIDTHS:
+        for ext in {os.path.splitext(filename)[1].lower(), ".jpg", ".webp"}:
+            name = variant_filename(filename, label, ext)
+            stat = storage.stat(name)
+            if stat:
+                storage.delete(name)
+                freed += stat[0]
+    return freed
+
+
+class ImageVariantWorker:
+    """Encodes image variants on a thread pool so the admin form returns straight away"""
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-variants")
+        self.app = None
+        self.on_ready = None
+
+    def init_app(self, app, image_model, storage, on_ready=None):
+        self.app = app
+        self.image_model = image_model
+        self.storage = storage
+        self.on_ready = on_ready   # called with the ProjectImage row once its variants are saved
+
+    def submit(self, image_id, filename):
+        return self.executor.submit(self._run, image_id, filename)
+
+    def _run(self, image_id, filename):
+        with self.app.app_context():
+            db = self.app.extensions["sqlalchemy"]
+
+            # Identical uploads share one file, so another image may already have its variants
+            done = db.session.execute(
+                select(self.image_model)
+                .where(self.image_model.image_file == filename, self.image_model.variants.is_not(None))
+                .limit(1)
+            ).scalar_one_or_none()
+            try:
+                if done is not None:
+                    variants = {"width": done.width, "height": done.height, "sizes": json.loads(done.variants)}
+                else:
+                    variants = build_variants(self.storage, filename)
+            except Exception as e:
+                self.app.logger.error(f"Image variants failed for {filename}: {e}")
+                return
+
+            image = db.session.get(self.image_model, image_id)
+
+            # The image may have been replaced or deleted while it was encoding
+            if image is None or image.image_file != filename:
+                return
+
+            image.width = variants["width"]
+            image.height = variants["height"]
+            image.variants = json.dumps(variants["sizes"])
+            db.session.commit()
+
+            if self.on_ready:
+                self.on_ready(image)
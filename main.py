@@ -1,34 +1,184 @@
 from flask_bootstrap import Bootstrap5
-from flask import Flask, render_template, redirect, url_for, request, flash, abort, current_app
+from flask import Flask, Blueprint, render_template, redirect, url_for, request, flash, abort, current_app, Response
 import random
 from datetime import date
 from forms import ContactForm, RegisterForm, LoginForm, CreateProjectPost
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, Text, ForeignKey
+from sqlalchemy import event
+from sqlalchemy.orm import load_only, selectinload, defer
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from markupsafe import Markup
-from send_mail import Email
+from send_mail import Email, StubTransport
+from models import db, ProjectPosts, ProjectImage, User, OutboxEmail, ContentRevision, PendingUploadDeletion, SweepCheckpoint
+from sampling import ProjectSampler
+from page_cache import PageCache, cache_backend_from_env
+from conditional import RevisionStore, conditional
+from search import SearchIndex
+from feeds import FeedCache
+from rate_limit import limiter_from_env
+from image_variants import ImageVariantWorker
+from upload_store import save_upload, dedupe_uploads
+from upload_gc import UploadGC
+from storage import UploadServer, storage_from_env
+from migrations import add_missing_columns, backfill_project_dates, parse_legacy_date
+from post_render import backfill_rendered_posts
+from bulk_transfer import export_archive, import_archive
+from assets import AssetManifest, build_assets
+from outbox import EmailOutbox
+from pagination import keyset_paginate, dated_keyset_paginate, cursor_key, dated_cursor_key, page_key
+from sql_metrics import SQLMetrics
+from request_timing import RequestTiming
+from pool_stats import PoolStats, engine_options_from_env
+from identity_cache import IdentityCache
 from flask_ckeditor import CKEditor
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from functools import wraps
 import os
 from dotenv import load_dotenv
-from datetime import datetime
-from typing import List
-import uuid
-
+import threading
+import time
+import click
 
-app = Flask(__name__, instance_path='/tmp')
-app.config['SECRET_KEY'] = os.environ.get('FLASK_KEY')
-Bootstrap5(app)
 
 load_dotenv()
 
+# All the routes and CLI commands, registered on the app by create_app()
+bp = Blueprint("main", __name__, cli_group=None)
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+
+# Where upload bytes live (STORAGE_BACKEND=filesystem|s3) and how /uploads/ hands them out (UPLOAD_SERVE)
+upload_storage = storage_from_env(default_root=UPLOAD_FOLDER)
+upload_server = UploadServer(upload_storage, mode=os.environ.get("UPLOAD_SERVE", "app"),
+                             accel_prefix=os.environ.get("UPLOAD_ACCEL_PREFIX", "/_uploads"))
+
+# Extensions and helpers are created here and bound to the app in create_app()
+bootstrap = Bootstrap5()
+ckeditor = CKEditor()
+
 # Authenticating/protecting the routes
 login_manager = LoginManager()
-login_manager.init_app(app)
+
+# JSON access log with per-phase timings, slow (SLOW_REQUEST_MS) and sampled requests are profiled to PROFILE_DIR
+request_timing = RequestTiming(slow_ms=int(os.environ.get("SLOW_REQUEST_MS", 1000)),
+                               sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+                               profile_dir=os.environ.get("PROFILE_DIR", "/tmp/profiles"),
+                               keep=int(os.environ.get("PROFILE_KEEP", 200)),
+                               access_log=os.environ.get("ACCESS_LOG", "1") != "0")
+
+# Checkout waits and connection churn of the engine's pool, reported on /health and /metrics
+pool_stats = PoolStats()
+
+# Logged-in users are served from here instead of a User query per request
+identity_cache = IdentityCache(ttl=int(os.environ.get("IDENTITY_CACHE_TTL", 60)))
+
+# Fingerprinted, precompressed static files, built with `flask --app main build-assets`
+asset_manifest = AssetManifest()
+
+# Per-request SQL counts/timings and N+1 warnings, exposed on /metrics
+sql_metrics = SQLMetrics(n_plus_one_threshold=int(os.environ.get("N_PLUS_ONE_THRESHOLD", 3)))
+
+# Random projects for the home page, only the card columns are loaded
+project_sampler = ProjectSampler(
+    model=ProjectPosts,
+    columns=[ProjectPosts.title, ProjectPosts.subtitle, ProjectPosts.img_url],
+    ttl=int(os.environ.get("PROJECT_SAMPLE_TTL", 300))
+)
+
+# Rendered public pages, evicted by the routes that write projects
+page_cache = PageCache(cache_backend_from_env(), ttl=int(os.environ.get("PAGE_CACHE_TTL", 300)))
+
+# Revisions behind the ETags, "global" covers listings and home, "project:<id>" a single project page.
+# The deploy part is the platform's commit id (RELEASE overrides it) plus the asset build, whose file names
+# change on every build-assets, so cached pages never point at assets the new deploy no longer has
+DEPLOY_COMMIT = os.environ.get("RELEASE") or os.environ.get("RENDER_GIT_COMMIT") or os.environ.get("SOURCE_VERSION", "")
+revisions = RevisionStore(db, ContentRevision,
+                          deploy=lambda: (f"{DEPLOY_COMMIT}:{asset_manifest.version}", asset_manifest.built_at))
+
+# sitemap.xml and the Atom feed, rebuilt from the posts that changed whenever the "global" revision moves
+# SITE_URL is the public origin their absolute links use, e.g. https://your-app-name.onrender.com
+feed_cache = FeedCache(revisions, ProjectPosts, site_url=os.environ.get("SITE_URL", "http://localhost:5000"),
+                       static_pages=["main.home", "main.projects", "main.resume", "main.about", "main.contact"],
+                       entries=int(os.environ.get("FEED_ENTRIES", 20)))
+
+# Full-text index over the posts, FTS5 on SQLite and tsvector/GIN on Postgres
+search_index = SearchIndex(db)
+
+# Token buckets per client IP for the expensive POSTs (scrypt on login, outbound email on contact)
+limiter = limiter_from_env()
+LOGIN_RATE_LIMIT = os.environ.get("LOGIN_RATE_LIMIT", "5/minute")
+CONTACT_RATE_LIMIT = os.environ.get("CONTACT_RATE_LIMIT", "3/minute")
+
+# Contact messages are stored first and delivered in the background, EMAIL_TRANSPORT=stub keeps them local
+# OUTBOX_ALERT_AFTER is how long a message may wait before /health, /metrics and the logs call it overdue
+email_outbox = EmailOutbox(batch_size=int(os.environ.get("OUTBOX_BATCH_SIZE", 10)),
+                           max_attempts=int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 6)),
+                           alert_after=int(os.environ.get("OUTBOX_ALERT_AFTER", 900)))
+
+# Released and orphaned upload blobs are deleted in the background, never inside a request
+upload_gc = UploadGC(grace=int(os.environ.get("UPLOAD_GC_GRACE", 3600)),
+                     batch_size=int(os.environ.get("UPLOAD_GC_BATCH_SIZE", 200)),
+                     interval=int(os.environ.get("UPLOAD_GC_INTERVAL", 300)))
+
+# Thumbnail/medium/full and WebP copies of uploads are encoded off the request thread
+image_worker = ImageVariantWorker(max_workers=int(os.environ.get("IMAGE_WORKERS", 2)))
+
+
+def create_app():
+    """Builds the app without touching the database or the network, so gunicorn workers boot fast"""
+    app = Flask(__name__, instance_path='/tmp')
+    app.config['SECRET_KEY'] = os.environ.get('FLASK_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DB_URI", "sqlite:///project_posts.db")
+    # Pool size/overflow/recycle/pre-ping from DB_POOL_*, size it so workers x (size + overflow) fits the server
+    engine_options = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+    if engine_options:
+        engine_options["poolclass"] = pool_stats.pool_class()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    # Request bodies over this are rejected with 413 before the upload is read
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", 16)) * 1024 * 1024
+
+    # Tell Flask-CKEditor to use your custom CKEditor folder
+    app.config['CKEDITOR_SERVE_LOCAL'] = True
+    app.config['CKEDITOR_PKG_TYPE'] = 'custom'
+    app.config['CKEDITOR_CUSTOM_JS'] = 'ckeditor/ckeditor.js'
+
+    bootstrap.init_app(app)
+    ckeditor.init_app(app)
+    login_manager.init_app(app)
+    db.init_app(app)
+    asset_manifest.init_app(app)
+
+    # Creating the engine does not connect, the first connection happens on the first query
+    with app.app_context():
+        sql_metrics.init_app(app, db.engine)
+        pool_stats.init_app(app, db.engine)
+    request_timing.init_app(app)
+
+    email_outbox.init_app(app, db, OutboxEmail,
+                          transport_factory=StubTransport if os.environ.get("EMAIL_TRANSPORT") == "stub" else Email)
+    image_worker.init_app(app, ProjectImage, upload_storage, on_ready=variants_ready)
+    upload_gc.init_app(app, db, ProjectImage, PendingUploadDeletion, SweepCheckpoint, upload_storage)
+
+    # Behind a proxy (Render, nginx) the client IP used by the rate limiter comes from X-Forwarded-For.
+    # The default 0 trusts no proxy, behind one every visitor then has the proxy's address and the per-IP
+    # login and contact limits are shared by all visitors together. Set PROXY_HOPS=1 on Render.
+    proxy_hops = int(os.environ.get("PROXY_HOPS", 0))
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops)
+    elif os.environ.get("RENDER"):
+        app.logger.warning("PROXY_HOPS is not set behind Render's proxy, rate limits apply to all visitors at once")
+    if "SITE_URL" not in os.environ and not app.debug:
+        app.logger.warning("SITE_URL is not set, sitemap.xml and feed.xml link to http://localhost:5000")
+
+    app.register_blueprint(bp)
+    return app
+
+
+def variants_ready(image):
+    # The project page now renders srcset, so its cached copy and ETag are stale
+    page_cache.evict(f"project:{image.post_id}")
+    revisions.bump(f"project:{image.post_id}")
+
 
 # ADMIN ACCESS DECORATOR
 def admin_access(func):
@@ -44,78 +194,130 @@ def admin_access(func):
     return decorator_function
 
 
-# Tell Flask-CKEditor to use your custom CKEditor folder
-app.config['CKEDITOR_SERVE_LOCAL'] = True
-app.config['CKEDITOR_PKG_TYPE'] = 'custom'
-app.config['CKEDITOR_CUSTOM_JS'] = 'ckeditor/ckeditor.js'
-
-ckeditor = CKEditor(app)
-
-# CREATE DATABASE
-class Base(DeclarativeBase):
-    pass
-
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DB_URI", "sqlite:///project_posts.db")
-db = SQLAlchemy(model_class=Base)
-db.init_app(app)
-
-class ProjectPosts(db.Model):
-    __tablename__ = "project_posts"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    title: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
-    subtitle: Mapped[str] = mapped_column(String(250), nullable=False)
-    date: Mapped[str] = mapped_column(String(250), nullable=False)
-    body: Mapped[str] = mapped_column(Text, nullable=False)
-    img_url: Mapped[str] = mapped_column(String(250), nullable=False)
-
-    # Relationship with the image model
-    images: Mapped[List["ProjectImage"]] = relationship(
-        back_populates="project",
-        cascade="all, delete-orphan"
-    )
-
-    def __init__(self, title, subtitle, body, img_url, date):
-        self.title = title
-        self.subtitle = subtitle
-        self.body = body
-        self.img_url = img_url
-        self.date = date
-
-class ProjectImage(db.Model):
-    __tablename__ = "project_images"
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    image_file: Mapped[str] = mapped_column(String(250), nullable=False)
-    image_description: Mapped[str] = mapped_column(String(250), nullable=True)
-    post_id: Mapped[int] = mapped_column(
-        ForeignKey("project_posts.id"),
-        nullable=False
-    )
-
-    # Relationship with project model
-    project: Mapped["ProjectPosts"] = relationship(
-        back_populates="images"
+##-----------CLI COMMANDS--------##
+@bp.cli.command("init-db")
+def init_db_command():
+    """Create the tables and add any columns/indexes missing from existing ones"""
+    db.create_all()
+    add_missing_columns(db.engine, db.metadata)
+    search_index.create_schema()
+    print("Database is up to date")
+
+
+@bp.cli.command("migrate-dates")
+@click.option("--batch-size", default=500, help="Rows converted per commit")
+def migrate_dates_command(batch_size):
+    """Convert the old ProjectPosts.date strings into the typed date columns"""
+    converted, unparsed = backfill_project_dates(db, ProjectPosts, batch_size=batch_size)
+    if converted:
+        # The pages show published_on now, their cached copies and ETags still carry the old date text
+        page_cache.evict("projects", *[f"project:{project_id}" for project_id in converted])
+        revisions.bump("global", *[f"project:{project_id}" for project_id in converted])
+    print(f"Converted {len(converted)} projects")
+    if unparsed:
+        print(f"Could not parse the date of projects: {unparsed}")
+
+
+@bp.cli.command("render-posts")
+@click.option("--batch-size", default=200, help="Posts rendered per commit")
+@click.option("--all", "rerender", is_flag=True, help="Re-render every post, e.g. after changing the allowed tags")
+def render_posts_command(batch_size, rerender):
+    """Store the sanitized HTML, excerpt and reading time of posts saved before those columns existed"""
+    rendered = backfill_rendered_posts(db, ProjectPosts, batch_size=batch_size, rerender=rerender)
+    if rendered:
+        page_cache.evict("projects", *[f"project:{project_id}" for project_id in rendered])
+        revisions.bump("global", *[f"project:{project_id}" for project_id in rendered])
+    print(f"Rendered {len(rendered)} projects")
+
+
+@bp.cli.command("dedupe-uploads")
+def dedupe_uploads_command():
+    """Rename existing uploads to their content hash, the old files are left to the upload GC"""
+    renamed, removed = dedupe_uploads(db.session, ProjectImage, upload_storage, release=upload_gc.defer)
+    print(f"Renamed {renamed} images, {removed} were duplicates. The old files are queued for gc-uploads")
+
+    # Variants are rebuilt under the new names in the background worker pool
+    for image in db.session.execute(db.select(ProjectImage).where(ProjectImage.variants.is_(None))).scalars():
+        image_worker.submit(image.id, image.image_file).result()
+
+
+@bp.cli.command("gc-uploads")
+@click.option("--dry-run", is_flag=True, help="Only report what would be deleted")
+def gc_uploads_command(dry_run):
+    """Delete upload files no project image references, older than UPLOAD_GC_GRACE seconds"""
+    scanned, files, freed = upload_gc.collect_all(dry_run=dry_run)
+    action = "Would remove" if dry_run else "Removed"
+    print(f"Scanned {scanned} files. {action} {files} files, {freed / 1024 / 1024:.2f} MB reclaimed")
+
+
+@bp.cli.command("rebuild-search-index")
+@click.option("--batch-size", default=500, help="Posts indexed per commit")
+def rebuild_search_index_command(batch_size):
+    """Rebuild the full-text search index from every project post"""
+    indexed = search_index.rebuild(ProjectPosts, batch_size=batch_size)
+    print(f"Indexed {indexed} projects")
+
+
+@bp.cli.command("export-projects")
+@click.argument("path")
+@click.option("--batch-size", default=500, help="Posts read per query")
+def export_projects_command(path, batch_size):
+    """Write every project, its images and their upload files to a tar archive (.tar or .tar.gz)"""
+    posts, files = export_archive(db, ProjectPosts, ProjectImage, upload_storage, path, batch_size=batch_size)
+    print(f"Exported {posts} projects and {files} upload files to {path}")
+
+
+@bp.cli.command("import-projects")
+@click.argument("path")
+@click.option("--batch-size", default=200, help="Posts committed per batch")
+def import_projects_command(path, batch_size):
+    """Restore an export-projects archive, projects whose title already exists are skipped"""
+    imported, skipped, files = import_archive(
+        db, ProjectPosts, ProjectImage, upload_storage, path, batch_size=batch_size,
+        on_created=lambda post: search_index.index(post.id, post.title, post.subtitle, post.body)
     )
+    print(f"Imported {imported} projects, skipped {skipped} existing, restored {files} upload files")
+
+    if imported:
+        project_sampler.invalidate()
+        page_cache.evict("projects")
+        revisions.bump("global")
+        # Variants are not in the archive, they are rebuilt (or shared) by the worker pool
+        for image in db.session.execute(db.select(ProjectImage).where(ProjectImage.variants.is_(None))).scalars():
+            image_worker.submit(image.id, image.image_file).result()
+
+
+@bp.cli.command("run-workers")
+def run_workers_command():
+    """Run the outbox, keep-alive and upload GC threads in this process until it is stopped"""
+    start_background_tasks()
+    print("Background workers running, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
 
-class User(db.Model, UserMixin):
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    name: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
-    email: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
-    password: Mapped[str] = mapped_column(String(250), nullable=False)
-
-    def __init__(self, name, email, password):
-        self.name = name
-        self.email = email
-        self.password = password
 
-with app.app_context():
-    db.create_all()
+@bp.cli.command("build-assets")
+def build_assets_command():
+    """Fingerprint, precompress and re-encode the static assets into static/dist"""
+    manifest = build_assets(current_app.static_folder)
+    asset_manifest.load()
+    print(f"Built {len(manifest)} assets into static/dist")
 
 
-# Providing a user_loader callback.
+# Providing a user_loader callback, only called when the session carries a user id
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return identity_cache.load(user_id, lambda id: db.session.get(User, id))
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def user_changed(mapper, connection, user):
+    # A new password, email or name also changes the stamp, so other workers drop the user on their next miss
+    identity_cache.invalidate(user.id)
 
 
 badge_classes = [
@@ -156,7 +358,8 @@ sql_labels = [
 ]
 
 
-@app.route("/")
+@bp.route("/")
+@conditional(revisions, ["global"])
 def home():
     # Making a dictionary list of badges to display the skills randomly
 
@@ -170,27 +373,27 @@ def home():
     pbi_badges = [{"label": label, "class": cls} for label, cls in zip(pbi_labels, badge_classes)]
     sql_badges = [{"label": label, "class": cls} for label, cls in zip(sql_labels, badge_classes)]
 
-    # Randomizing the list of projects
-    # projects = range(6)
-    all_projects = db.session.execute(db.select(ProjectPosts)).scalars().all()
-    random.shuffle(all_projects)   #This will randomize the projects list
-    to_display = all_projects[:3]
+    # Randomizing the list of projects, sampled from the cached ids instead of loading the whole table
+    to_display = project_sampler.sample(db.session, k=3)
 
     return render_template("index.html", projects=to_display, python_badges=python_badges,
                            pbi_badges=pbi_badges, sql_badges=sql_badges, logged_in=current_user.is_authenticated)
 
 
-@app.route("/resume")
+@bp.route("/resume")
+@page_cache.cached("resume")
 def resume():
     return render_template("resume.html", logged_in=current_user.is_authenticated)
 
 
-@app.route("/about")
+@bp.route("/about")
+@page_cache.cached("about")
 def about():
     return render_template("about.html", logged_in=current_user.is_authenticated)
 
 
-@app.route("/contact", methods=['GET', 'POST'])
+@bp.route("/contact", methods=['GET', 'POST'])
+@limiter.limit(CONTACT_RATE_LIMIT)
 def contact():
     contact_form = ContactForm()
     if contact_form.validate_on_submit():
@@ -199,16 +402,17 @@ def contact():
         phone = contact_form["phone"].data
         message = contact_form["message"].data
 
-        send_message = Email()
-
+        # Saved to the outbox here, the background workers deliver it with retries
         try:
-            send_message.post_email(name=name, email=email, phone=phone, message=message)
+            email_outbox.enqueue(name=name, email=email, phone=phone, message=message)
+            email_outbox.backlog()   # warns in the log when the worker process has stopped delivering
             flash("Successfully sent your message!", "success")
         except Exception as e:
-            app.logger.error(f"Email failed: {e}")
-            flash("Message sent, but email delivery failed.", "warning")
+            db.session.rollback()
+            current_app.logger.error(f"Saving email failed: {e}")
+            flash("Your message could not be saved, please try again.", "warning")
 
-        return redirect(url_for("contact"))
+        return redirect(url_for("main.contact"))
 
     return render_template("contact.html", form=contact_form, logged_in=current_user.is_authenticated)
 
@@ -216,7 +420,7 @@ def contact():
     # contact_form.process(formdata=None)
 
 
-@app.route("/create-project", methods=["GET", "POST"])
+@bp.route("/create-project", methods=["GET", "POST"])
 @admin_access
 def create_project():
     project_post = CreateProjectPost()
@@ -226,38 +430,41 @@ def create_project():
             subtitle=project_post.subtitle.data,
             body=project_post.body.data,
             img_url=project_post.img_url.data,
-            date=date.today().strftime("%d/%m/%Y")
+            date=date.today()
         )
 
-        # upload folder
-        upload_folder = os.path.join(app.root_path, "static", "uploads")
-        os.makedirs(upload_folder, exist_ok=True)  #this ensures the folder exists
-        print("Upload folder is at:", upload_folder)
-
         # Looping through the FieldList in the ImageForm
         for project_image in project_post.images:
             image_file = project_image.image_file.data
-            print(image_file)
 
-            if image_file:   #Save uploaded image to root folder
-                filename = f"{uuid.uuid4().hex}_{secure_filename(image_file.filename)}"  #prevents overwriting existing filename and avoid duplicate files
-                image_file.save(os.path.join("static/uploads", filename))
+            if image_file:   #Save uploaded image once per content hash, identical files share one blob
+                filename = save_upload(image_file, upload_storage)
 
                 new_image = ProjectImage(image_file=filename, image_description=project_image.image_description.data)
                 new_project.images.append(new_image)
 
         db.session.add(new_project)
+        db.session.flush()   # the search index needs the new id, both are committed together
+        search_index.index(new_project.id, new_project.title, new_project.subtitle, new_project.body)
         db.session.commit()
-        return redirect(url_for("projects")) #change it to projects
+        # Read once here, every later commit would expire and reload them
+        new_images = [(image.id, image.image_file) for image in new_project.images]
+        project_sampler.invalidate()
+        page_cache.evict("projects")
+        revisions.bump("global", f"project:{new_project.id}")
+
+        for image_id, filename in new_images:
+            image_worker.submit(image_id, filename)
+        return redirect(url_for("main.projects")) #change it to projects
     print(project_post.errors)
     return render_template("create_project.html", form=project_post, logged_in=current_user.is_authenticated)
 
 
-@app.route("/edit-project/<int:project_id>", methods=["GET", "POST"])
+@bp.route("/edit-project/<int:project_id>", methods=["GET", "POST"])
 @admin_access
 def edit_project(project_id):
     # get the current user_id of the user and check if it has an id==1
-    project = db.get_or_404(ProjectPosts, project_id)
+    project = db.get_or_404(ProjectPosts, project_id, options=[selectinload(ProjectPosts.images)])
     edit_form = CreateProjectPost()
 
     # Prefill form on GET
@@ -278,36 +485,48 @@ def edit_project(project_id):
         project.subtitle = edit_form.subtitle.data
         project.img_url = edit_form.img_url.data
         project.body = edit_form.body.data
+        project.render_body()
 
-        # upload folder
-        upload_folder = os.path.join(app.root_path, "static", "uploads")
-        os.makedirs(upload_folder, exist_ok=True)
-
+        replaced_images = []
+        old_files = []
         for i, image_form in enumerate(edit_form.images):
             image_file = image_form.image_file.data
 
             # If new file is uploaded, replace old file
             if image_file:
-                filename = f"{uuid.uuid4().hex}_{secure_filename(image_file.filename)}"
-                image_file.save(os.path.join(upload_folder, filename))
+                filename = save_upload(image_file, upload_storage)
 
                 # If image exists already, update it
                 if i < len(project.images):
-                    # delete old file
-                    old_path = os.path.join(upload_folder, project.images[i].image_file)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
+                    # The old blob is only removed after the commit, if no other image uses it
+                    if project.images[i].image_file == filename:
+                        project.images[i].image_description = image_form.image_description.data
+                        continue
+                    old_files.append(project.images[i].image_file)
 
                     project.images[i].image_file = filename
                     project.images[i].image_description = image_form.image_description.data
+                    project.images[i].width = project.images[i].height = project.images[i].variants = None
+                    replaced_images.append(project.images[i])
 
                 else:
                     # Create new image
                     new_image = ProjectImage(image_file=filename, image_description=image_form.image_description.data)
                     project.images.append(new_image)
+                    replaced_images.append(new_image)
 
+        search_index.index(project_id, project.title, project.subtitle, project.body)
+        # Old files are deleted by the upload GC, only once no other image uses them
+        upload_gc.defer(old_files)
         db.session.commit()
-        return redirect(url_for("show_project", project_id=project.id, logged_in=current_user.is_authenticated))
+        # Read once here, every later commit would expire and reload them
+        replaced_images = [(image.id, image.image_file) for image in replaced_images]
+        page_cache.evict("projects", f"project:{project_id}")
+        revisions.bump("global", f"project:{project_id}")
+
+        for image_id, filename in replaced_images:
+            image_worker.submit(image_id, filename)
+        return redirect(url_for("main.show_project", project_id=project_id, logged_in=current_user.is_authenticated))
 
     return render_template("create_project.html",
                            form=edit_form,
@@ -316,71 +535,163 @@ def edit_project(project_id):
                            logged_in=current_user.is_authenticated)
 
 
-@app.route("/projects")
+@bp.route("/projects")
+@conditional(revisions, ["global"])
+@page_cache.cached("projects", vary_on={"page": page_key, "cursor": cursor_key})
 def projects():
-    page = request.args.get("page", 1, type=int)
     per_page = 5  # number of projects per page
 
-    pagination = db.paginate(
-        db.select(ProjectPosts).order_by(ProjectPosts.id.desc()),
-        page=page,
-        per_page=per_page,
-        error_out=False
+    # The listing only shows the cards, so the body Text is never loaded
+    listing = db.select(ProjectPosts).options(
+        load_only(ProjectPosts.title, ProjectPosts.subtitle, ProjectPosts.published_on, ProjectPosts.date,
+                  ProjectPosts.img_url, ProjectPosts.reading_minutes)
     )
-    # Add formatted_date for each project without changing the DB (long date format for first 2 projects)
-    for project in pagination.items:
-        try:
-            old_date = datetime.strptime(project.date, "%B %d, %Y")
-            project.formatted_date = old_date.strftime("%d/%m/%Y")
-        except ValueError:
-            # If project in desired format, keep it
-            project.formatted_date = project.date
+
+    if "page" in request.args:
+        # Old ?page=N links still work with offset paging
+        page = request.args.get("page", 1, type=int)
+        pagination = db.paginate(
+            listing.order_by(ProjectPosts.id.desc()),
+            page=page,
+            per_page=per_page,
+            error_out=False
+        )
+        prev_url = url_for("main.projects", page=pagination.prev_num) if pagination.has_prev else None
+        next_url = url_for("main.projects", page=pagination.next_num) if pagination.has_next else None
+    else:
+        # Keyset paging, each page is an index range scan from the cursor however deep it is
+        pagination = keyset_paginate(db.session, listing, ProjectPosts.id,
+                                     cursor=request.args.get("cursor"), per_page=per_page)
+        prev_url = url_for("main.projects", cursor=pagination.prev_cursor) if pagination.prev_cursor else None
+        next_url = url_for("main.projects", cursor=pagination.next_cursor) if pagination.next_cursor else None
 
     return render_template(
         "all_projects.html",
         all_projects=pagination.items,
         pagination=pagination,
+        prev_url=prev_url,
+        next_url=next_url,
         logged_in=current_user.is_authenticated
     )
 
 
-@app.route("/project/<int:project_id>")
+@bp.route("/projects/<int:year>")
+@conditional(revisions, ["global"])
+@page_cache.cached("projects", vary_on={"cursor": dated_cursor_key})
+def projects_by_year(year):
+    # date() only covers years 1-9999 and the range below needs the next year too
+    if not 1 <= year <= 9998:
+        abort(404)
+
+    # Archive for one year, newest first, every page is a range scan on the (published_on, id) index
+    listing = db.select(ProjectPosts).options(
+        load_only(ProjectPosts.title, ProjectPosts.subtitle, ProjectPosts.published_on, ProjectPosts.date,
+                  ProjectPosts.img_url, ProjectPosts.reading_minutes)
+    ).where(ProjectPosts.published_on >= date(year, 1, 1), ProjectPosts.published_on < date(year + 1, 1, 1))
+
+    pagination = dated_keyset_paginate(db.session, listing, ProjectPosts.published_on, ProjectPosts.id,
+                                       cursor=request.args.get("cursor"), per_page=5)
+    prev_url = url_for("main.projects_by_year", year=year, cursor=pagination.prev_cursor) if pagination.prev_cursor else None
+    next_url = url_for("main.projects_by_year", year=year, cursor=pagination.next_cursor) if pagination.next_cursor else None
+
+    return render_template(
+        "all_projects.html",
+        all_projects=pagination.items,
+        pagination=pagination,
+        prev_url=prev_url,
+        next_url=next_url,
+        logged_in=current_user.is_authenticated
+    )
+
+
+@bp.app_template_filter("format_date")
+def format_date(value, date_format="%d/%m/%Y"):
+    # Rows not migrated yet only have the old date string, parsed so every page shows one format
+    if isinstance(value, str):
+        value = parse_legacy_date(value) or value
+    if isinstance(value, str) or value is None:
+        return value or ""   # not a known legacy format, shown as it is
+    return value.strftime(date_format)
+
+
+@bp.route("/project/<int:project_id>")
+@conditional(revisions, lambda project_id: [f"project:{project_id}"])
+@page_cache.cached(lambda project_id: f"project:{project_id}")
 def show_project(project_id):
-    requested_project = db.get_or_404(ProjectPosts, project_id)
+    # The images are always shown, load them with the post instead of lazily from the template
+    # The raw body is only for the editor, the page shows the HTML rendered when the post was saved
+    requested_project = db.get_or_404(ProjectPosts, project_id,
+                                      options=[selectinload(ProjectPosts.images), defer(ProjectPosts.body)])
+    return render_template("show_project.html", project=requested_project, description=requested_project.excerpt,
+                           logged_in=current_user.is_authenticated)
 
-    # Add a formatted date in the order "%B %d, %Y"
-    try:
-        old_date = datetime.strptime(requested_project.date, "%d/%m/%Y")
-        requested_project.formatted_date = old_date.strftime("%B %d, %Y")
-    except ValueError:
-        # If project in desired format, keep it
-        requested_project.formatted_date = requested_project.date
-    return render_template("show_project.html", project=requested_project, logged_in=current_user.is_authenticated)
 
+@bp.route("/sitemap.xml")
+@conditional(revisions, ["global"])
+def sitemap():
+    return Response(feed_cache.sitemap(), mimetype="application/xml")
+
+
+@bp.route("/feed.xml")
+@conditional(revisions, ["global"])
+def atom_feed():
+    return Response(feed_cache.atom(), mimetype="application/atom+xml")
+
+
+@bp.route("/uploads/<path:filename>")
+def uploaded_file(filename):
+    # Immutable content-hash names, offloaded to nginx/Apache or the object store when UPLOAD_SERVE says so
+    return upload_server.response(filename)
+
+
+@bp.app_template_global()
+def upload_url(filename):
+    return upload_server.url_for(filename, lambda name: url_for("main.uploaded_file", filename=name))
+
+
+@bp.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = 10
+
+    # One extra result tells whether there is a next page
+    results = search_index.search(query, limit=per_page + 1, offset=(page - 1) * per_page) if query else []
 
-@app.route("/delete/<int:project_id>", methods=["GET", "POST"])
+    return render_template("search.html",
+                           query=query,
+                           results=results[:per_page],
+                           page=page,
+                           has_next=len(results) > per_page,
+                           logged_in=current_user.is_authenticated)
+
+
+@bp.route("/delete/<int:project_id>", methods=["GET", "POST"])
 @admin_access
 def delete(project_id):
-    project = db.get_or_404(ProjectPosts, project_id)
+    project = db.get_or_404(ProjectPosts, project_id, options=[selectinload(ProjectPosts.images)])
     
     if request.method == "POST":
-        # Delete image file save to the disk in static/uploads
-        for image in project.images:
-            file_path = os.path.join(current_app.root_path, "static", "uploads", image.image_file)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        image_files = {image.image_file for image in project.images}
 
         # Delete the project
+        search_index.remove(project_id)
         db.session.delete(project)
+        # The files are queued with the delete and removed by the upload GC, unless another project uses them
+        upload_gc.defer(image_files)
         db.session.commit()
+
+        project_sampler.invalidate()
+        page_cache.evict("projects", f"project:{project_id}")
+        revisions.bump("global", f"project:{project_id}")
         flash("Project deleted successfully.")
-        return redirect(url_for("projects"))
+        return redirect(url_for("main.projects"))
 
     # GET request → show confirmation page
     return render_template("confirm_delete.html", project=project)
 
 
-@app.route("/register", methods=['GET', 'POST'])
+@bp.route("/register", methods=['GET', 'POST'])
 def register():
     # Hide the registration route entirely if user exists
     if db.session.execute(db.select(User).limit(1)).scalar_one_or_none():
@@ -407,12 +718,13 @@ def register():
             
         flash("Thanks for registering!", "success")
         login_user(user)
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     return render_template("register.html", form=register_form, logged_in=current_user.is_authenticated)
 
 
-@app.route("/login", methods=['GET', 'POST'])
+@bp.route("/login", methods=['GET', 'POST'])
+@limiter.limit(LOGIN_RATE_LIMIT)
 def login():
     login_form = LoginForm()
     if login_form.validate_on_submit():
@@ -422,49 +734,71 @@ def login():
         user = db.session.execute(db.select(User).where(User.email == email)).scalar()
         if not user:
             flash(Markup(f"This email does not exist. Please try again!"))
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         elif not check_password_hash(user.password, password):
             flash("Password incorrect. Please try again!")
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         else:
             login_user(user)
-            return redirect(url_for("home"))
+            return redirect(url_for("main.home"))
     return render_template("login.html", form=login_form, logged_in=current_user.is_authenticated)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
 
-##-----------KEEPING SUPABASE FROM INACTIVITY--------##
-from supabase import create_client, Client
+##-----------METRICS--------##
+@bp.route("/metrics")
+@admin_access
+def metrics():
+    # Prometheus text format, each gunicorn worker reports its own numbers
+    return Response(sql_metrics.render() + pool_stats.render() + email_outbox.render(),
+                    mimetype="text/plain; version=0.0.4")
 
-# Initialise Supabase client
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+@bp.route("/admin/slow-requests")
+@admin_access
+def slow_requests():
+    # Profiles saved by every worker on this host, newest PROFILE_KEEP of them
+    return render_template("slow_requests.html", profiles=request_timing.slowest(),
+                           slow_ms=request_timing.slow_ms, logged_in=current_user.is_authenticated)
+
 
-@app.route("/health")
+##-----------HEALTH--------##
+@bp.route("/health")
 @admin_access
 def health_check():
+    # A cheap round trip through the app's own engine, which also keeps a hosted database from idling
+    started = time.perf_counter()
+    outbox = None
     try:
-        # Run a lightweight query
-        result = supabase.table("project_posts").select("id").limit(1).execute()
-        return {"status": "ok"}, 200
+        db.session.execute(db.text("SELECT 1"))
+        status, code, details = "ok", 200, None
+        database_ms = round((time.perf_counter() - started) * 1000, 3)
+        # Contact emails are delivered by the worker process, an overdue backlog means it is not running
+        outbox = email_outbox.backlog()
+        if outbox["oldest_pending_seconds"] > email_outbox.alert_after:
+            status, details = "degraded", "contact emails are not being delivered, is `flask run-workers` running?"
     except Exception as e:
-        return {"status": "error", "details": str(e)}, 500
+        db.session.rollback()
+        status, code, details = "error", 500, str(e)
+        database_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    body = {"status": status, "database_ms": database_ms, "pool": pool_stats.snapshot(), "outbox": outbox}
+    if details:
+        body["details"] = details
+    return body, code
 
 
 ##----------KEEP AWAKE---------##
-import threading
-import requests
-import time
 
 def keep_alive():
+    import requests
+
     url = "https://your-app-name.onrender.com"  # replace with your actual URL
     while True:
         try:
@@ -474,10 +808,30 @@ def keep_alive():
             print(f"Keep-alive ping failed: {e}")
         time.sleep(600)  # ping every 10 minutes
 
-# Start the keep-alive thread when the app starts
-thread = threading.Thread(target=keep_alive, daemon=True)
-thread.start()
+
+_background_started = False
+
+def start_background_tasks():
+    """Starts the keep-alive, outbox and upload GC threads once per process.
+    In production they run in the `flask run-workers` process (the Procfile worker), never in a gunicorn master."""
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+
+    thread = threading.Thread(target=keep_alive, daemon=True)
+    thread.start()
+
+    # Start delivering queued contact emails
+    email_outbox.start(workers=int(os.environ.get("OUTBOX_WORKERS", 1)))
+
+    # Queued upload deletions and a bounded orphan sweep every UPLOAD_GC_INTERVAL seconds
+    upload_gc.start()
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
-    app.run(debug=False)
\ No newline at end of file
+    start_background_tasks()
+    app.run(debug=False)
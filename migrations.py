@@ -0,0 +1,75 @@
+from datetime import datetime, time
+
+from sqlalchemy import inspect, text, select
+
+
+# Formats that ended up in the old ProjectPosts.date string column
+LEGACY_DATE_FORMATS = ["%d/%m/%Y", "%B %d, %Y"]
+
+
+def add_missing_columns(engine, metadata):
+    """db.create_all() only creates missing tables, so new nullable columns and indexes are added to existing tables here"""
+
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+
+
+def parse_legacy_date(value):
+    for date_format in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def backfill_project_dates(db, model, batch_size=500):
+    """Fills published_on/created_at/updated_at from the old date strings, one committed batch at a time.
+    Returns the ids converted and the ids whose date could not be parsed"""
+
+    converted, unparsed, last_id = [], [], 0
+    while True:
+        # Walk the table by id so every batch is a small index range and memory stays flat
+        rows = db.session.execute(
+            select(model)
+            .where(model.id > last_id, model.published_on.is_(None))
+            .order_by(model.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not rows:
+            break
+
+        for row in rows:
+            published_on = parse_legacy_date(row.date)
+            if published_on is None:
+                unparsed.append(row.id)
+                continue
+
+            row.published_on = published_on
+            row.created_at = row.created_at or datetime.combine(published_on, time.min)
+            row.updated_at = row.updated_at or row.created_at
+            converted.append(row.id)
+
+        last_id = rows[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+
+    return converted, unparsed
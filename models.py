@@ -0,0 +1,165 @@
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, Date, Index
+from datetime import date, datetime
+from typing import List, Optional
+import json
+
+from image_variants import variant_filename
+from outbox import QUEUED, utcnow
+from identity_cache import credential_stamp
+from post_render import render_post
+
+
+# CREATE DATABASE
+class Base(DeclarativeBase):
+    pass
+
+db = SQLAlchemy(model_class=Base)
+
+class ProjectPosts(db.Model):
+    __tablename__ = "project_posts"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    title: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
+    subtitle: Mapped[str] = mapped_column(String(250), nullable=False)
+    date: Mapped[str] = mapped_column(String(250), nullable=False)  # old string date, kept in sync with published_on
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    img_url: Mapped[str] = mapped_column(String(250), nullable=False)
+    # Typed dates, rows from before these columns existed are filled in by `flask migrate-dates`
+    published_on: Mapped[Optional["date"]] = mapped_column(Date, nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, default=utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, default=utcnow, onupdate=utcnow)
+    # Rendered from body on every write, rows from before these columns existed are filled in by `flask render-posts`
+    body_html: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    excerpt: Mapped[Optional[str]] = mapped_column(String(300), nullable=True)
+    reading_minutes: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    # Relationship with the image model
+    images: Mapped[List["ProjectImage"]] = relationship(
+        back_populates="project",
+        cascade="all, delete-orphan"
+    )
+
+    __table_args__ = (
+        # Serves "newest first" and "by year" archive queries as index range scans
+        Index("ix_project_posts_published_on", "published_on", "id"),
+    )
+
+    def __init__(self, title, subtitle, body, img_url, date):
+        self.title = title
+        self.subtitle = subtitle
+        self.body = body
+        self.img_url = img_url
+        self.published_on = date
+        self.date = date.strftime("%d/%m/%Y")
+        self.render_body()
+
+    def render_body(self):
+        # Sanitized once here, views serve body_html as it is
+        self.body_html, self.excerpt, self.reading_minutes = render_post(self.body)
+
+    @property
+    def html(self):
+        # Rows not rendered yet are sanitized on the fly until `flask render-posts` has run
+        return self.body_html if self.body_html is not None else render_post(self.body)[0]
+
+class ProjectImage(db.Model):
+    __tablename__ = "project_images"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    image_file: Mapped[str] = mapped_column(String(250), nullable=False, index=True)  # content-hash blob, may be shared
+    image_description: Mapped[str] = mapped_column(String(250), nullable=True)
+    # Filled in by the background image worker, until then the original upload is served
+    width: Mapped[int] = mapped_column(Integer, nullable=True)
+    height: Mapped[int] = mapped_column(Integer, nullable=True)
+    variants: Mapped[str] = mapped_column(Text, nullable=True)
+    post_id: Mapped[int] = mapped_column(
+        ForeignKey("project_posts.id"),
+        nullable=False
+    )
+
+    # Relationship with project model
+    project: Mapped["ProjectPosts"] = relationship(
+        back_populates="images"
+    )
+
+    def srcset(self, upload_url, webp=False):
+        # Each stored variant as "url width", in the format the browser picks from
+        return ", ".join(
+            f"{upload_url(variant_filename(self.image_file, variant['label'], '.webp' if webp else variant['ext']))} {variant['width']}w"
+            for variant in json.loads(self.variants)
+        )
+
+class User(db.Model, UserMixin):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
+    email: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
+    password: Mapped[str] = mapped_column(String(250), nullable=False)
+
+    def __init__(self, name, email, password):
+        self.name = name
+        self.email = email
+        self.password = password
+
+    def get_id(self):
+        # The stamp in the session id lets the identity cache skip the lookup and logs out old sessions
+        return f"{self.id}:{credential_stamp(self)}"
+
+class OutboxEmail(db.Model):
+    # Contact form submissions waiting to be delivered by the outbox workers
+    __tablename__ = "email_outbox"
+    __table_args__ = (Index("ix_email_outbox_due", "status", "next_attempt_at"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(250), nullable=False)
+    email: Mapped[str] = mapped_column(String(250), nullable=False)
+    phone: Mapped[str] = mapped_column(String(250), nullable=False)
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default=QUEUED)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    def __init__(self, name, email, phone, message):
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self.message = message
+
+class ContentRevision(db.Model):
+    # Named counters ("global", "project:<id>") bumped on every write, the ETags are derived from them
+    __tablename__ = "content_revisions"
+
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    revision: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+
+    def __init__(self, name, revision, updated_at):
+        self.name = name
+        self.revision = revision
+        self.updated_at = updated_at
+
+class PendingUploadDeletion(db.Model):
+    # Blobs released by deletes and image replacements, removed by the upload GC outside the request
+    __tablename__ = "pending_upload_deletions"
+
+    filename: Mapped[str] = mapped_column(String(250), primary_key=True)
+    queued_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow)
+
+    def __init__(self, filename):
+        self.filename = filename
+
+class SweepCheckpoint(db.Model):
+    # Where an incremental scan stopped, so the next batch (or the next process) carries on from there
+    __tablename__ = "sweep_checkpoints"
+
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    position: Mapped[str] = mapped_column(String(250), nullable=False, default="")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    def __init__(self, name, position=""):
+        self.name = name
+        self.position = position
@@ -0,0 +1,143 @@
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, or_, and_, func
+
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+
+
+def utcnow():
+    # Naive UTC so the same values work in SQLite and Postgres timestamp columns
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class EmailOutbox:
+    """Stores contact messages in the request and delivers them from background threads"""
+
+    def __init__(self, batch_size=10, max_attempts=6, base_delay=30, lease=120, poll_interval=5, alert_after=900):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts   # after this many failures a message goes to the dead state
+        self.base_delay = base_delay       # seconds before the first retry, doubled on every failure
+        self.lease = lease                 # a message stuck in "sending" this long is picked up again
+        self.poll_interval = poll_interval
+        self.alert_after = alert_after     # seconds a message may wait before the backlog is logged as a warning
+
+        self._wake = threading.Event()
+        self._threads = []
+
+    def init_app(self, app, db, model, transport_factory):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.transport_factory = transport_factory   # returns an object with post_email(name, email, phone, message)
+        self._transport = None
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = self.transport_factory()
+        return self._transport
+
+    def enqueue(self, name, email, phone, message):
+        """Adds a message to the outbox, committed with the caller's session"""
+        outbox_message = self.model(name=name, email=email, phone=phone, message=message)
+        self.db.session.add(outbox_message)
+        self.db.session.commit()
+        self._wake.set()
+        return outbox_message
+
+    def backlog(self):
+        """Messages not delivered yet and the age of the oldest in seconds, logs a warning once it is overdue.
+        Delivery happens in the `flask run-workers` process, a backlog that only grows means it is not running"""
+        pending, oldest, dead = self.db.session.execute(
+            select(
+                func.count().filter(self.model.status.in_([QUEUED, SENDING])),
+                func.min(self.model.created_at).filter(self.model.status.in_([QUEUED, SENDING])),
+                func.count().filter(self.model.status == DEAD),
+            )
+        ).one()
+        oldest_age = round((utcnow() - oldest).total_seconds()) if oldest else 0
+        if oldest_age > self.alert_after:
+            self.app.logger.warning(f"{pending} contact emails waiting, the oldest for {oldest_age} s, "
+                                    f"is `flask run-workers` running?")
+        return {"pending": pending, "oldest_pending_seconds": oldest_age, "dead": dead}
+
+    def render(self):
+        """The backlog as Prometheus gauges"""
+        return "".join(f"email_outbox_{name} {value}\n" for name, value in self.backlog().items())
+
+    def _claim(self, session):
+        now = utcnow()
+        due = or_(
+            and_(self.model.status == QUEUED, self.model.next_attempt_at <= now),
+            and_(self.model.status == SENDING, self.model.next_attempt_at <= now),   # lease expired, worker died
+        )
+        candidates = session.execute(
+            select(self.model.id, self.model.attempts).where(due).order_by(self.model.id).limit(self.batch_size)
+        ).all()
+
+        claimed = []
+        for message_id, attempts in candidates:
+            # The update only matches if no other worker claimed the row first, so it works without row locks
+            result = session.execute(
+                update(self.model)
+                .where(self.model.id == message_id, self.model.attempts == attempts, due)
+                .values(status=SENDING, next_attempt_at=now + timedelta(seconds=self.lease))
+            )
+            if result.rowcount == 1:
+                claimed.append(message_id)
+        session.commit()
+        return claimed
+
+    def deliver_batch(self):
+        """Sends one batch of due messages, returns how many were attempted"""
+        with self.app.app_context():
+            session = self.db.session
+            claimed = self._claim(session)
+
+            for message_id in claimed:
+                outbox_message = session.get(self.model, message_id)
+                try:
+                    self.transport.post_email(name=outbox_message.name, email=outbox_message.email,
+                                              phone=outbox_message.phone, message=outbox_message.message)
+                except Exception as e:
+                    outbox_message.attempts += 1
+                    outbox_message.last_error = str(e)[:500]
+                    if outbox_message.attempts >= self.max_attempts:
+                        outbox_message.status = DEAD
+                        self.app.logger.error(f"Email {message_id} moved to dead letters: {e}")
+                    else:
+                        # Exponential backoff with some jitter so failed messages don't retry in lockstep
+                        delay = self.base_delay * 2 ** (outbox_message.attempts - 1)
+                        outbox_message.status = QUEUED
+                        outbox_message.next_attempt_at = utcnow() + timedelta(seconds=delay * random.uniform(1, 1.25))
+                else:
+                    outbox_message.status = SENT
+                    outbox_message.sent_at = utcnow()
+                session.commit()
+
+            return len(claimed)
+
+    def _run(self):
+        while True:
+            try:
+                delivered = self.deliver_batch()
+            except Exception as e:
+                self.app.logger.error(f"Outbox worker failed: {e}")
+                delivered = 0
+
+            # A full batch means there may be more waiting, otherwise sleep until the next poll or enqueue
+            if delivered < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self, workers=1):
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
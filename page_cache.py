@@ -0,0 +1,187 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, session, make_response
+from flask_login import current_user
+
+
+class MemoryCache:
+    """In-process LRU cache with a TTL, one per gunicorn worker"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group, variant):
+        key = (group, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)   # most recently used goes to the back
+            return entry
+
+    def set(self, group, variant, entry):
+        key = (group, variant)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def evict(self, group):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == group]:
+                del self._entries[key]
+
+
+class FileSystemCache:
+    """Shared cache on disk so every gunicorn worker sees the same entries and evictions"""
+
+    def __init__(self, cache_dir, max_entries=5000, prune_every=100):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries   # across all workers, the soonest to expire go first
+        self.prune_every = prune_every   # writes between two scans of the cache folder
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _group_dir(self, group):
+        return os.path.join(self.cache_dir, hashlib.md5(group.encode()).hexdigest())
+
+    def _path(self, group, variant):
+        return os.path.join(self._group_dir(group), hashlib.md5(variant.encode()).hexdigest())
+
+    def get(self, group, variant):
+        path = self._path(group, variant)
+        try:
+            with open(path, "rb") as f:
+                expires = float(f.readline())
+                mimetype = f.readline().decode().strip()
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+
+        if expires < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return {"expires": expires, "mimetype": mimetype, "body": body}
+
+    def set(self, group, variant, entry):
+        group_dir = self._group_dir(group)
+        os.makedirs(group_dir, exist_ok=True)
+
+        # Write to a temp file first so other workers never read a half written entry
+        fd, tmp_path = tempfile.mkstemp(dir=group_dir, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(f"{entry['expires']}\n{entry['mimetype']}\n".encode())
+            f.write(entry["body"])
+        # The expiry doubles as the mtime, so pruning needs a stat per entry instead of a read
+        os.utime(tmp_path, (entry["expires"], entry["expires"]))
+        os.replace(tmp_path, self._path(group, variant))
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Deletes expired entries, then the soonest to expire until at most max_entries are left"""
+        now = time.time()
+        entries = []
+        for group in os.scandir(self.cache_dir):
+            if not group.is_dir():
+                continue
+            for entry in os.scandir(group.path):
+                if entry.name.startswith("."):
+                    continue   # another worker is still writing it
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass   # evicted meanwhile
+
+        entries.sort()
+        expired = sum(1 for expires, _ in entries if expires < now)
+        for _, path in entries[:max(expired, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def evict(self, group):
+        shutil.rmtree(self._group_dir(group), ignore_errors=True)
+
+
+class PageCache:
+    """Caches rendered public pages, keyed by page group, path, query args, login state and content revisions"""
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+
+    def cached(self, group, vary_on=None):
+        """group is a string or a function of the view args, e.g. lambda project_id: f"project:{project_id}".
+        vary_on maps query args to a function giving their canonical form, or None for a value not worth caching"""
+
+        def decorator(func):
+            @wraps(func)
+            def decorator_function(*args, **kwargs):
+                # Pending flash messages are shown once, so those responses must not be cached or served from cache
+                if request.method != "GET" or "_flashes" in session:
+                    return func(*args, **kwargs)
+
+                group_name = group(**kwargs) if callable(group) else group
+                query = []
+                for arg, canonical in (vary_on or {}).items():
+                    value = canonical(request.args.get(arg))
+                    if value is None:
+                        return func(*args, **kwargs)   # junk values would each fill a cache entry
+                    query.append(f"{arg}={value}")
+
+                # Under @conditional the revisions are part of the key, an edit made through another worker
+                # is a miss here even though this worker's copy was never evicted
+                variant = "|".join(
+                    [request.path, f"logged_in={current_user.is_authenticated}", g.get("content_revisions", "")] + query
+                )
+
+                entry = self.backend.get(group_name, variant)
+                if entry is not None:
+                    response = make_response(entry["body"])
+                    response.mimetype = entry["mimetype"]
+                    response.headers["X-Cache"] = "HIT"
+                    return response
+
+                response = make_response(func(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.backend.set(group_name, variant, {
+                        "expires": time.time() + self.ttl,
+                        "mimetype": response.mimetype,
+                        "body": response.get_data(),
+                    })
+                    response.headers["X-Cache"] = "MISS"
+                return response
+            return decorator_function
+        return decorator
+
+    def evict(self, *groups):
+        for group in groups:
+            self.backend.evict(group)
+
+
+def cache_backend_from_env():
+    # PAGE_CACHE_DIR points every worker at the same folder, otherwise each worker keeps its own LRU
+    cache_dir = os.environ.get("PAGE_CACHE_DIR")
+    if cache_dir:
+        return FileSystemCache(cache_dir, max_entries=int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 5000)))
+    return MemoryCache(max_entries=int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 512)))
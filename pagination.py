@@ -0,0 +1,140 @@
+import base64
+import binascii
+from datetime import date
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(direction, last_id):
+    # Opaque to visitors, "a" pages to older projects and "b" back to newer ones
+    return base64.urlsafe_b64encode(f"{direction}:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (direction, id), or None for a missing or tampered cursor"""
+    if not cursor:
+        return None
+    try:
+        direction, last_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        if direction not in ("a", "b"):
+            return None
+        return direction, int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def encode_dated_cursor(direction, published_on, last_id):
+    return base64.urlsafe_b64encode(f"{direction}:{published_on.isoformat()}:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_dated_cursor(cursor):
+    """Returns (direction, date, id), or None for a missing or tampered cursor"""
+    if not cursor:
+        return None
+    try:
+        direction, published_on, last_id = \
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        if direction not in ("a", "b"):
+            return None
+        return direction, date.fromisoformat(published_on), int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def cursor_key(cursor):
+    """Canonical form of a cursor for cache keys, "" when there is none and None when it is tampered"""
+    if not cursor:
+        return ""
+    position = decode_cursor(cursor)
+    return encode_cursor(*position) if position else None
+
+
+def dated_cursor_key(cursor):
+    """cursor_key for the cursors of dated_keyset_paginate"""
+    if not cursor:
+        return ""
+    position = decode_dated_cursor(cursor)
+    return encode_dated_cursor(*position) if position else None
+
+
+def page_key(page):
+    """Canonical form of an old ?page=N for cache keys, None unless it is a positive number"""
+    if page is None:
+        return ""
+    try:
+        number = int(page)
+    except ValueError:
+        return None
+    return str(number) if number >= 1 else None
+
+
+class KeysetPage:
+    """One page of rows ordered by id descending, fetched with WHERE id < ? instead of OFFSET"""
+
+    def __init__(self, items, has_next, has_prev, cursor_of=lambda direction, row: encode_cursor(direction, row.id)):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.cursor_of = cursor_of
+
+    @property
+    def next_cursor(self):
+        return self.cursor_of("a", self.items[-1]) if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self.cursor_of("b", self.items[0]) if self.has_prev and self.items else None
+
+
+def keyset_paginate(session, stmt, id_column, cursor=None, per_page=5):
+    """stmt is an unordered select, the page is read straight off the primary key index"""
+
+    position = decode_cursor(cursor)
+
+    # One extra row tells whether there is another page without a COUNT(*)
+    if position is None:
+        rows = session.execute(stmt.order_by(id_column.desc()).limit(per_page + 1)).scalars().all()
+        return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_prev=False)
+
+    direction, last_id = position
+    if direction == "a":
+        rows = session.execute(
+            stmt.where(id_column < last_id).order_by(id_column.desc()).limit(per_page + 1)
+        ).scalars().all()
+        return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_prev=True)
+
+    rows = session.execute(
+        stmt.where(id_column > last_id).order_by(id_column.asc()).limit(per_page + 1)
+    ).scalars().all()
+    return KeysetPage(list(reversed(rows[:per_page])), has_next=True, has_prev=len(rows) > per_page)
+
+
+def dated_keyset_paginate(session, stmt, date_column, id_column, cursor=None, per_page=5):
+    """Newest first by (date, id), each page is a range scan on an index over those two columns"""
+
+    position = decode_dated_cursor(cursor)
+    key = tuple_(date_column, id_column)
+    newest_first = (date_column.desc(), id_column.desc())
+
+    def cursor_of(direction, row):
+        return encode_dated_cursor(direction, getattr(row, date_column.key), row.id)
+
+    if position is None:
+        rows = session.execute(stmt.order_by(*newest_first).limit(per_page + 1)).scalars().all()
+        return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_prev=False, cursor_of=cursor_of)
+
+    # The plain date bound is what the index range starts from, the row value comparison breaks the ties
+    direction, published_on, last_id = position
+    if direction == "a":
+        rows = session.execute(
+            stmt.where(date_column <= published_on, key < (published_on, last_id))
+            .order_by(*newest_first).limit(per_page + 1)
+        ).scalars().all()
+        return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_prev=True, cursor_of=cursor_of)
+
+    rows = session.execute(
+        stmt.where(date_column >= published_on, key > (published_on, last_id))
+        .order_by(date_column.asc(), id_column.asc()).limit(per_page + 1)
+    ).scalars().all()
+    return KeysetPage(list(reversed(rows[:per_page])), has_next=True, has_prev=len(rows) > per_page,
+                      cursor_of=cursor_of)
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def engine_options_from_env(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE and DB_POOL_PRE_PING"""
+
+    url = make_url(database_uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}   # in-memory SQLite keeps a single connection, there is no pool to size
+
+    server = url.get_backend_name() != "sqlite"
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        # Hosted Postgres (Supabase, Render) drops idle connections, so they are recycled and checked before use
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800 if server else -1)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1" if server else "0") != "0",
+    }
+
+
+class PoolStats:
+    """Connection churn and checkout wait times of the engine's pool, per worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.invalidated = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.engine = None
+
+    def pool_class(self, base=QueuePool):
+        """A pool class that times every checkout, passed as the engine's poolclass so it survives dispose()"""
+        stats = self
+
+        class TimedPool(base):
+            def connect(self):
+                started = time.perf_counter()
+                try:
+                    return super().connect()
+                except exc.TimeoutError:
+                    stats._timed_out()
+                    raise
+                finally:
+                    stats._waited(time.perf_counter() - started)
+
+        TimedPool.base_name = base.__name__
+        return TimedPool
+
+    def init_app(self, app, engine):
+        self.engine = engine
+        # Pool events registered on the engine carry over to the new pool after dispose()
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "close", self._on_close)
+        event.listen(engine, "close_detached", self._on_close)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.opened += 1
+
+    def _on_close(self, dbapi_connection, *args):
+        with self._lock:
+            self.closed += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def _waited(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        pool = self.engine.pool
+        with self._lock:
+            stats = {
+                "pool": getattr(type(pool), "base_name", type(pool).__name__),
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "connections_opened": self.opened,
+                "connections_closed": self.closed,
+                "connections_invalidated": self.invalidated,
+            }
+        # Only QueuePool has a size, SQLite memory and NullPool-style pools do not
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+                         overflow=max(pool.overflow(), 0))
+        return stats
+
+    def render(self):
+        """The snapshot as Prometheus gauges and counters"""
+        lines = []
+        for name, value in self.snapshot().items():
+            if isinstance(value, (int, float)):
+                lines.append(f"db_pool_{name} {value}")
+        return "\n".join(lines) + "\n"
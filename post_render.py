@@ -0,0 +1,80 @@
+import math
+import re
+
+import bleach
+from bleach.html5lib_shim import Filter
+from sqlalchemy import select
+
+from search import plain_text
+
+
+# What CKEditor produces for a post, everything else (scripts, inline handlers, styles) is stripped
+ALLOWED_TAGS = [
+    "p", "br", "hr", "div", "span", "h1", "h2", "h3", "h4", "h5", "h6",
+    "b", "strong", "i", "em", "u", "s", "strike", "sub", "sup", "small", "mark",
+    "blockquote", "pre", "code", "ul", "ol", "li", "a", "img", "figure", "figcaption",
+    "table", "thead", "tbody", "tfoot", "tr", "th", "td", "caption",
+]
+ALLOWED_ATTRIBUTES = {
+    "*": ["class"],
+    "a": ["href", "title", "target", "rel"],
+    "img": ["src", "alt", "title", "width", "height"],
+    "th": ["colspan", "rowspan"],
+    "td": ["colspan", "rowspan"],
+}
+ALLOWED_PROTOCOLS = ["http", "https", "mailto"]
+
+# bleach strips these tags but keeps their contents as text, so the whole element is dropped first
+SCRIPT_ELEMENTS = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+EXCERPT_LENGTH = 280
+WORDS_PER_MINUTE = 200
+
+
+class LazyImages(Filter):
+    """Embedded images load when scrolled to and decode off the main thread"""
+
+    def __iter__(self):
+        for token in super().__iter__():
+            if token["type"] in ("StartTag", "EmptyTag") and token["name"] == "img":
+                token["data"][(None, "loading")] = "lazy"
+                token["data"][(None, "decoding")] = "async"
+            yield token
+
+
+cleaner = bleach.Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, protocols=ALLOWED_PROTOCOLS,
+                         strip=True, filters=[LazyImages])
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(" ", 1)[0] + "…"
+
+
+def render_post(body):
+    """CKEditor HTML -> (sanitized HTML, plain-text excerpt, reading time in minutes)"""
+    body = SCRIPT_ELEMENTS.sub("", body or "")
+    text = plain_text(body)
+    return cleaner.clean(body), excerpt(text), max(1, math.ceil(len(text.split()) / WORDS_PER_MINUTE))
+
+
+def backfill_rendered_posts(db, model, batch_size=200, rerender=False):
+    """Renders posts that have no stored HTML yet (or all of them), one committed batch at a time, returns their ids"""
+
+    rendered, last_id = [], 0
+    while True:
+        query = select(model).where(model.id > last_id).order_by(model.id).limit(batch_size)
+        if not rerender:
+            query = query.where(model.body_html.is_(None))
+        rows = db.session.execute(query).scalars().all()
+        if not rows:
+            break
+
+        for row in rows:
+            row.render_body()
+            rendered.append(row.id)
+        last_id = rendered[-1]
+        db.session.commit()
+        db.session.expunge_all()   # keeps memory flat on large tables
+    return rendered
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, current_app, make_response
+
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_limit(limit):
+    """'5/minute' -> (capacity 5, refill rate in tokens per second)"""
+    count, period = limit.split("/")
+    return int(count), int(count) / PERIODS[period.strip().rstrip("s")]
+
+
+def refill(tokens, updated, capacity, rate, now):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """Buckets in this process only, each gunicorn worker counts separately"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # least recently used first
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Takes one token, returns 0 if allowed or the seconds until the next token"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = refill(tokens, updated, capacity, rate, now)
+
+            if key in self._buckets:
+                self._buckets.move_to_end(key)
+            elif len(self._buckets) >= self.max_keys:
+                # A hard cap at O(1) per new key, under a flood of new IPs the least recently seen bucket goes
+                self._buckets.popitem(last=False)
+
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            return wait
+
+
+class SQLiteBackend:
+    """Buckets in a local SQLite file so every gunicorn worker on the host shares them"""
+
+    def __init__(self, path, prune_interval=60):
+        self.path = path
+        self.prune_interval = prune_interval   # seconds between deletes of buckets that are full again
+        self._refill_time = 0                  # longest capacity / rate seen, a bucket idle that long is full
+        self._last_prune = time.time()
+        self._local = threading.local()
+
+        conn = sqlite3.connect(path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        conn.commit()
+        conn.close()
+
+    def _connection(self):
+        # One connection per thread and process, SQLite connections must not cross a gunicorn fork
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def take(self, key, capacity, rate):
+        now = time.time()   # wall clock, monotonic time is not comparable between processes
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")   # one writer at a time, so the read-modify-write is atomic
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill(row[0], row[1], capacity, rate, now) if row else capacity
+
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if wait == 0:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+
+            # A full bucket carries no state, dropping it keeps a flood of new IPs from growing the file forever
+            self._refill_time = max(self._refill_time, capacity / rate)
+            if now - self._last_prune > self.prune_interval:
+                self._last_prune = now
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self._refill_time,))
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RateLimiter:
+    """Token buckets per client IP and endpoint, checked before the view does any work"""
+
+    def __init__(self, backend=None, enabled=True):
+        self.backend = backend or MemoryBackend()
+        self.enabled = enabled
+
+    def limit(self, limit, methods=("POST",)):
+        capacity, rate = parse_limit(limit)
+
+        def decorator(func):
+            @wraps(func)
+            def decorator_function(*args, **kwargs):
+                if self.enabled and request.method in methods:
+                    key = f"{request.endpoint}:{request.remote_addr}"
+                    retry_after = self.backend.take(key, capacity, rate)
+                    if retry_after:
+                        current_app.logger.warning(f"Rate limited {key}")
+                        response = make_response("Too many requests, please try again later.", 429)
+                        response.headers["Retry-After"] = str(int(retry_after) + 1)
+                        return response
+                return func(*args, **kwargs)
+            return decorator_function
+        return decorator
+
+
+def limiter_from_env():
+    # RATE_LIMIT_DB shares the buckets between workers, RATE_LIMITS_ENABLED=0 turns limiting off (benchmarks)
+    path = os.environ.get("RATE_LIMIT_DB")
+    backend = SQLiteBackend(path) if path else MemoryBackend()
+    return RateLimiter(backend, enabled=os.environ.get("RATE_LIMITS_ENABLED", "1") != "0")
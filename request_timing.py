@@ -0,0 +1,232 @@
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request, before_render_template, template_rendered
+from werkzeug.wsgi import ClosingIterator
+
+
+TOP_FRAMES = 25
+MAX_STACK_DEPTH = 64
+
+
+def frame_label(filename, line, function):
+    return f"{os.path.basename(filename)}:{line}:{function}"
+
+
+class StackSampler:
+    """One thread per process that records the call stack of every in-flight request every few milliseconds"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}   # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._busy = threading.Event()   # set while any request is in flight, the thread sleeps otherwise
+        self._pid = None
+
+    def _ensure_running(self):
+        # Threads do not survive a gunicorn fork, so each worker starts its own on first use
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="stack-sampler", daemon=True).start()
+
+    def register(self):
+        with self._lock:
+            self._ensure_running()
+            self._active[threading.get_ident()] = Counter()
+            self._busy.set()
+
+    def unregister(self):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), Counter())
+            if not self._active:
+                self._busy.clear()
+            return stacks
+
+    def _run(self):
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._active.items():
+                    frame, stack = frames.get(thread_id), []
+                    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                        stack.append(frame_label(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+                        frame = frame.f_back
+                    if stack:
+                        stacks[";".join(reversed(stack))] += 1
+
+
+def sampled_top_frames(stacks):
+    """(frame, self samples, cumulative samples) from collapsed stacks, the most expensive first"""
+    own, cumulative = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            cumulative[frame] += count
+    return [[frame, own[frame], count] for frame, count in cumulative.most_common(TOP_FRAMES)]
+
+
+def profiled_top_frames(profile):
+    """(frame, self ms, cumulative ms) from a cProfile run, by self time"""
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FRAMES]
+    return [[frame_label(*key), round(tt * 1000, 3), round(ct * 1000, 3)] for key, (_, _, tt, ct, _) in rows]
+
+
+class RequestTiming:
+    """JSON access log with routing/DB/render/total timings, and profiles of slow or sampled requests"""
+
+    def __init__(self, slow_ms=1000, sample_rate=0.0, profile_dir="/tmp/profiles", keep=200, access_log=True):
+        self.slow_ms = slow_ms            # requests slower than this keep their stack samples, 0 turns it off
+        self.sample_rate = sample_rate    # fraction of requests run under cProfile
+        self.profile_dir = profile_dir
+        self.keep = keep                  # newest profiles kept in profile_dir, older ones are deleted
+        self.access_log = access_log
+        self.sampler = StackSampler()
+
+        self.logger = logging.getLogger("portfolio.access")
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+
+    def init_app(self, app):
+        self.app = app
+        app.wsgi_app = self._middleware(app.wsgi_app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _middleware(self, wsgi_app):
+        def timed_app(environ, start_response):
+            started = time.perf_counter()
+            environ["timing.start"] = started
+            status = []
+
+            def timed_start_response(status_line, headers, exc_info=None):
+                status.append(int(status_line.split(" ", 1)[0]))
+                return start_response(status_line, headers, exc_info)
+
+            if self.slow_ms:
+                self.sampler.register()
+            profile = None
+            if self.sample_rate and random.random() < self.sample_rate:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    profile = None   # another thread is being profiled (Python 3.12+ allows only one)
+
+            def finished():
+                # Called when the server closes the response, so streaming bodies are part of the total
+                if profile:
+                    profile.disable()
+                stacks = self.sampler.unregister() if self.slow_ms else None
+                self._report(environ, status[0] if status else 500, time.perf_counter() - started, profile, stacks)
+
+            try:
+                return ClosingIterator(wsgi_app(environ, timed_start_response), [finished])
+            except BaseException:
+                finished()
+                raise
+
+        return timed_app
+
+    def _start_request(self):
+        # Everything before the first before_request hook: WSGI environ, context push, session and URL matching
+        g.timing_routing = time.perf_counter() - request.environ["timing.start"]
+        g.timing_render = 0.0
+
+    def _render_started(self, sender, template, context, **extra):
+        g.timing_render_start = time.perf_counter()
+
+    def _render_finished(self, sender, template, context, **extra):
+        if "timing_render_start" in g:
+            g.timing_render += time.perf_counter() - g.pop("timing_render_start")
+
+    def _finish_request(self, response):
+        # g is gone by the time the body has been sent, the phases travel to the middleware in the environ
+        request.environ["timing.phases"] = {
+            "endpoint": request.endpoint,
+            "routing_ms": round(g.get("timing_routing", 0.0) * 1000, 3),
+            "db_ms": round(g.get("sql_time", 0.0) * 1000, 3),
+            "db_queries": sum(g.sql_shapes.values()) if "sql_shapes" in g else 0,
+            "render_ms": round(g.get("timing_render", 0.0) * 1000, 3),
+        }
+        return response
+
+    def _report(self, environ, status, elapsed, profile, stacks):
+        phases = environ.get("timing.phases", {})
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "method": environ.get("REQUEST_METHOD"),
+            "path": environ.get("PATH_INFO"),
+            "status": status,
+            "remote_addr": environ.get("REMOTE_ADDR"),
+            **phases,
+            "total_ms": round(elapsed * 1000, 3),
+        }
+        if self.access_log:
+            self.logger.info(json.dumps(entry))
+
+        try:
+            if profile:
+                self._save(entry, "cprofile", profiled_top_frames(profile), profile=profile)
+            elif stacks and elapsed * 1000 >= self.slow_ms:
+                self._save(entry, "samples", sampled_top_frames(stacks), stacks=stacks)
+        except Exception as e:
+            self.app.logger.error(f"Could not save the profile of {entry['path']}: {e}")
+
+    def _save(self, entry, kind, top_frames, profile=None, stacks=None):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        # Sortable by time down to the millisecond, so rotation drops the oldest
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}.{int(time.time() * 1000) % 1000:03d}-{uuid.uuid4().hex[:8]}"
+        record = dict(entry, id=name, kind=kind, top_frames=top_frames)
+        if stacks:
+            # Collapsed stacks, the input format of flamegraph.pl and speedscope
+            record["stacks"] = dict(stacks.most_common(200))
+        if profile:
+            profile.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+
+        tmp_path = os.path.join(self.profile_dir, f".{name}.json")
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, os.path.join(self.profile_dir, f"{name}.json"))
+        self._rotate()
+
+    def _rotate(self):
+        saved = sorted(glob.glob(os.path.join(self.profile_dir, "*.json")))
+        for path in saved[:-self.keep]:
+            for stale in (path, path[:-len(".json")] + ".prof"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass   # no .prof for sampled stacks, or another worker rotated it first
+
+    def slowest(self, limit=50):
+        """Saved profiles of every worker on this host, the slowest first"""
+        records = []
+        for path in glob.glob(os.path.join(self.profile_dir, "*.json")):
+            try:
+                with open(path) as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue   # rotated away or half written by another worker
+        return sorted(records, key=lambda record: record["total_ms"], reverse=True)[:limit]
@@ -0,0 +1,49 @@
+import random
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+
+
+class ProjectSampler:
+    """Picks random projects for the home page without loading the whole table"""
+
+    def __init__(self, model, columns, ttl=300):
+        self.model = model
+        self.columns = columns   # only the card columns get loaded, never the body Text
+        self.ttl = ttl
+
+        self._ids = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drop the cached ids, call this after a project is created or deleted"""
+        with self._lock:
+            self._ids = None
+
+    def _project_ids(self, session):
+        # The id list is tiny compared to the rows, so each worker keeps it in memory.
+        # The TTL lets workers that did not see the write pick up new/deleted projects.
+        with self._lock:
+            if self._ids is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._ids = session.execute(select(self.model.id)).scalars().all()
+                self._loaded_at = time.monotonic()
+            return self._ids
+
+    def sample(self, session, k=3):
+        ids = self._project_ids(session)
+        picked = random.sample(ids, min(k, len(ids)))
+        if not picked:
+            return []
+
+        rows = session.execute(
+            select(self.model)
+            .options(load_only(*self.columns))
+            .where(self.model.id.in_(picked))
+        ).scalars().all()
+
+        # WHERE id IN (...) comes back in index order, keep the random order instead
+        by_id = {row.id: row for row in rows}
+        return [by_id[project_id] for project_id in picked if project_id in by_id]
@@ -0,0 +1,133 @@
+import html
+import re
+
+import bleach
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+
+# Snippet markers that cannot appear in stripped post text, swapped for <mark> after escaping
+START, STOP = "\x02", "\x03"
+TOKEN = re.compile(r"\w+", re.UNICODE)
+# Tags that separate words on the page, stripping them must leave a space behind. Inline tags like <b> can
+# sit inside a word, so they are stripped without one
+BREAKING_TAG = re.compile(
+    r"</?(?:address|article|aside|blockquote|br|caption|dd|div|dl|dt|figcaption|figure|footer|h[1-6]|header|hr|"
+    r"img|li|ol|p|pre|section|table|tbody|td|tfoot|th|thead|tr|ul)\b[^>]*>",
+    re.IGNORECASE,
+)
+
+
+def plain_text(body):
+    """CKEditor HTML to the plain text that gets indexed"""
+    stripped = bleach.clean(BREAKING_TAG.sub(" ", body or ""), tags=[], strip=True)
+    return re.sub(r"\s+", " ", html.unescape(stripped)).strip()
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet)).replace(START, "<mark>").replace(STOP, "</mark>"))
+
+
+class SearchIndex:
+    """Full-text index over project posts, SQLite FTS5 or a Postgres tsvector with a GIN index"""
+
+    def __init__(self, db=None):
+        self.db = db
+
+    def init_app(self, db):
+        self.db = db
+
+    @property
+    def dialect(self):
+        return self.db.engine.dialect.name
+
+    def create_schema(self):
+        with self.db.engine.begin() as conn:
+            if self.dialect == "sqlite":
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS project_search "
+                    "USING fts5(title, subtitle, body, tokenize='porter unicode61')"
+                ))
+            else:
+                conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS project_search ("
+                    " post_id INTEGER PRIMARY KEY REFERENCES project_posts(id) ON DELETE CASCADE,"
+                    " title TEXT NOT NULL, subtitle TEXT NOT NULL, body TEXT NOT NULL,"
+                    " document tsvector GENERATED ALWAYS AS ("
+                    "  setweight(to_tsvector('english', title), 'A') ||"
+                    "  setweight(to_tsvector('english', subtitle), 'B') ||"
+                    "  setweight(to_tsvector('english', body), 'C')) STORED)"
+                ))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_project_search_document ON project_search USING GIN (document)"
+                ))
+
+    def index(self, project_id, title, subtitle, body):
+        """Adds or replaces one post, runs in the caller's transaction"""
+        params = {"id": project_id, "title": title, "subtitle": subtitle, "body": plain_text(body)}
+        self.remove(project_id)
+        if self.dialect == "sqlite":
+            self.db.session.execute(text(
+                "INSERT INTO project_search (rowid, title, subtitle, body) VALUES (:id, :title, :subtitle, :body)"
+            ), params)
+        else:
+            self.db.session.execute(text(
+                "INSERT INTO project_search (post_id, title, subtitle, body) VALUES (:id, :title, :subtitle, :body)"
+            ), params)
+
+    def remove(self, project_id):
+        key = "rowid" if self.dialect == "sqlite" else "post_id"
+        self.db.session.execute(text(f"DELETE FROM project_search WHERE {key} = :id"), {"id": project_id})
+
+    def rebuild(self, model, batch_size=500):
+        """Re-indexes every post in id order, one committed batch at a time"""
+        self.create_schema()
+        self.db.session.execute(text("DELETE FROM project_search"))
+
+        indexed, last_id = 0, 0
+        while True:
+            rows = self.db.session.execute(
+                self.db.select(model.id, model.title, model.subtitle, model.body)
+                .where(model.id > last_id).order_by(model.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row in rows:
+                self.index(row.id, row.title, row.subtitle, row.body)
+            indexed += len(rows)
+            last_id = rows[-1].id
+            self.db.session.commit()
+        self.db.session.commit()
+        return indexed
+
+    def search(self, query, limit=10, offset=0):
+        """Ranked matches as dicts with id, title, subtitle and a highlighted snippet"""
+
+        # Only word characters reach the match expression, every word is a prefix match
+        tokens = TOKEN.findall(query or "")[:10]
+        if not tokens:
+            return []
+
+        params = {"limit": limit, "offset": offset, "start": START, "stop": STOP}
+        if self.dialect == "sqlite":
+            params["query"] = " ".join(f'"{token}"*' for token in tokens)
+            rows = self.db.session.execute(text(
+                "SELECT rowid AS id, title, subtitle,"
+                " snippet(project_search, 2, :start, :stop, ' … ', 24) AS snippet"
+                " FROM project_search WHERE project_search MATCH :query"
+                " ORDER BY bm25(project_search, 10.0, 5.0, 1.0) LIMIT :limit OFFSET :offset"
+            ), params).mappings().all()
+        else:
+            params["query"] = " & ".join(f"{token}:*" for token in tokens)
+            params["options"] = f"StartSel={START}, StopSel={STOP}, MaxWords=30, MinWords=12, MaxFragments=2"
+            # The GIN index finds and ranks the page first, ts_headline then only runs on those rows
+            rows = self.db.session.execute(text(
+                "SELECT hits.post_id AS id, hits.title, hits.subtitle,"
+                " ts_headline('english', hits.body, hits.query, :options) AS snippet"
+                " FROM (SELECT post_id, title, subtitle, body, query, ts_rank_cd(document, query) AS rank"
+                "       FROM project_search, to_tsquery('english', :query) AS query"
+                "       WHERE document @@ query ORDER BY rank DESC LIMIT :limit OFFSET :offset) AS hits"
+                " ORDER BY hits.rank DESC"
+            ), params).mappings().all()
+
+        return [dict(row, snippet=highlight(row["snippet"])) for row in rows]
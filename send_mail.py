@@ -39,3 +39,18 @@ class Email:
         except Exception as e:
             raise RuntimeError(f"Resend email failed: {e}")
 
+
+class StubTransport:
+    """Local stand-in for Email, keeps the messages in memory so the outbox can run without network access"""
+
+    def __init__(self, fail_times=0):
+        self.sent = []
+        self.fail_times = fail_times   # the first n sends raise, to exercise retries
+
+    def post_email(self, name, email, phone, message):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise RuntimeError("Stub email failed")
+
+        self.sent.append({"name": name, "email": email, "phone": phone, "message": message})
+        return {"id": f"stub-{len(self.sent)}"}
@@ -0,0 +1,115 @@
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_COUNT_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+
+def statement_shape(statement):
+    # Bound parameters are already "?"/"%(name)s", only whitespace and expanded IN lists differ between calls
+    shape = re.sub(r"\s+", " ", statement).strip()
+    return re.sub(r"\((?:\s*(?:\?|%\(\w+\)s)\s*,)+\s*(?:\?|%\(\w+\)s)\s*\)", "(?)", shape)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = defaultdict(lambda: {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+
+    def observe(self, endpoint, value):
+        series = self.series[endpoint]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["counts"][i] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for endpoint, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series["counts"]):
+                lines.append(f'{self.name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {series["count"]}')
+            lines.append(f'{self.name}_sum{{endpoint="{endpoint}"}} {series["sum"]}')
+            lines.append(f'{self.name}_count{{endpoint="{endpoint}"}} {series["count"]}')
+        return lines
+
+
+class SQLMetrics:
+    """Counts and times the SQL statements of each request and flags repeated statement shapes (likely N+1)"""
+
+    def __init__(self, n_plus_one_threshold=3):
+        self.n_plus_one_threshold = n_plus_one_threshold   # same statement shape this many times in one request
+        self._lock = threading.Lock()
+
+        self.request_duration = Histogram("http_request_duration_seconds",
+                                          "Request latency per endpoint", DURATION_BUCKETS)
+        self.sql_duration = Histogram("sql_request_duration_seconds",
+                                      "Total time spent in SQL per request", DURATION_BUCKETS)
+        self.sql_queries = Histogram("sql_queries_per_request",
+                                     "Number of SQL statements per request", QUERY_COUNT_BUCKETS)
+        self.n_plus_one = Counter()
+
+    def init_app(self, app, engine):
+        self.app = app
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+
+        # Statements outside a request (CLI commands, background workers) are not attributed to an endpoint
+        if not has_request_context() or "sql_shapes" not in g:
+            return
+        g.sql_time += elapsed
+        g.sql_shapes[statement_shape(statement)] += 1
+
+    def _start_request(self):
+        g.request_start = time.perf_counter()
+        g.sql_time = 0.0
+        g.sql_shapes = Counter()
+
+    def _finish_request(self, response):
+        if "request_start" not in g:
+            return response
+
+        endpoint = request.endpoint or "unmatched"
+        query_count = sum(g.sql_shapes.values())
+        repeated = {shape: count for shape, count in g.sql_shapes.items() if count >= self.n_plus_one_threshold}
+
+        with self._lock:
+            self.request_duration.observe(endpoint, time.perf_counter() - g.request_start)
+            self.sql_duration.observe(endpoint, g.sql_time)
+            self.sql_queries.observe(endpoint, query_count)
+            if repeated:
+                self.n_plus_one[endpoint] += 1
+
+        for shape, count in repeated.items():
+            self.app.logger.warning(f"Possible N+1 on {endpoint}: {count}x {shape[:200]}")
+        return response
+
+    def render(self):
+        """All metrics of this worker in the Prometheus text format"""
+        with self._lock:
+            lines = []
+            for histogram in (self.request_duration, self.sql_duration, self.sql_queries):
+                lines.extend(histogram.render())
+
+            lines.append("# HELP sql_suspected_n_plus_one_total Requests that repeated a statement shape")
+            lines.append("# TYPE sql_suspected_n_plus_one_total counter")
+            for endpoint, count in sorted(self.n_plus_one.items()):
+                lines.append(f'sql_suspected_n_plus_one_total{{endpoint="{endpoint}"}} {count}')
+        return "\n".join(lines) + "\n"
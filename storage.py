@@ -0,0 +1,251 @@
+import heapq
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+
+from flask import abort, redirect, send_file, Response
+from werkzeug.security import safe_join
+
+try:
+    import boto3   # optional, only needed for STORAGE_BACKEND=s3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+CHUNK_SIZE = 64 * 1024
+# Upload names are content hashes (variants derive from them), so a URL always points at the same bytes
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class FileSystemStorage:
+    """Uploads in a local directory, static/uploads by default"""
+
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def staging_dir(self):
+        # Same filesystem as the uploads, so moving a finished temp file into place is an atomic rename
+        os.makedirs(self.root, exist_ok=True)
+        return self.root
+
+    def local_path(self, name):
+        return safe_join(self.root, name)
+
+    def exists(self, name):
+        return os.path.exists(self.local_path(name))
+
+    def size(self, name):
+        return os.path.getsize(self.local_path(name))
+
+    def stat(self, name):
+        """(size, modified unix time) or None if the file does not exist"""
+        try:
+            stat = os.stat(self.local_path(name))
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def touch(self, name):
+        os.utime(self.local_path(name))
+
+    def listing(self, start_after="", limit=500):
+        """(name, size, modified) of the top-level files after start_after in name order, variants live below"""
+        if not os.path.isdir(self.root):
+            return []
+        names = heapq.nsmallest(limit, (entry.name for entry in os.scandir(self.root)
+                                        if entry.is_file() and entry.name > start_after))
+        return [(name, *stat) for name in names if (stat := self.stat(name))]
+
+    def open(self, name):
+        return open(self.local_path(name), "rb")
+
+    def save(self, name, fileobj):
+        """Streams a file object into place under a temp name first, readers never see half a file"""
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def save_file(self, name, tmp_path):
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def delete(self, name):
+        path = self.local_path(name)
+        if path and os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def url(self, name):
+        return None   # served by the app (or the proxy in front of it)
+
+    def public_url(self, name):
+        return None
+
+
+class S3Storage:
+    """Uploads in an S3-compatible bucket (AWS, R2, MinIO, or moto_server as a local stand-in)"""
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, public_url=None, url_expires=3600):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3, pip install boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.public_base = public_url.rstrip("/") if public_url else None
+        self.url_expires = url_expires
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        # Created per thread and process, credentials come from the usual AWS_* variables
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.client = boto3.session.Session().client("s3", endpoint_url=self.endpoint_url)
+            self._local.pid = os.getpid()
+        return self._local.client
+
+    staging_dir = None   # finished uploads are hashed in the system temp dir, then sent to the bucket
+
+    def key(self, name):
+        return self.prefix + name
+
+    def local_path(self, name):
+        return None
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        return self._head(name)["ContentLength"]
+
+    def stat(self, name):
+        head = self._head(name)
+        return (head["ContentLength"], head["LastModified"].timestamp()) if head else None
+
+    def touch(self, name):
+        # Copying an object onto itself with new metadata is how S3 updates LastModified
+        self.client.copy_object(Bucket=self.bucket, Key=self.key(name), MetadataDirective="REPLACE",
+                                CopySource={"Bucket": self.bucket, "Key": self.key(name)},
+                                ContentType=mimetypes.guess_type(name)[0] or "application/octet-stream",
+                                CacheControl=IMMUTABLE)
+
+    def listing(self, start_after="", limit=500):
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=self.prefix, Delimiter="/",
+                                               StartAfter=self.key(start_after), MaxKeys=limit)
+        return [(item["Key"][len(self.prefix):], item["Size"], item["LastModified"].timestamp())
+                for item in response.get("Contents", [])]
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))["Body"]
+
+    def save(self, name, fileobj):
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.client.upload_fileobj(fileobj, self.bucket, self.key(name),
+                                   ExtraArgs={"ContentType": content_type, "CacheControl": IMMUTABLE})
+
+    def save_file(self, name, tmp_path):
+        with open(tmp_path, "rb") as f:
+            self.save(name, f)
+        os.remove(tmp_path)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        return True
+
+    def url(self, name):
+        """A URL the browser can fetch directly, signed unless the bucket is public"""
+        return self.public_url(name) or self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.key(name)}, ExpiresIn=self.url_expires
+        )
+
+    def public_url(self, name):
+        # Stable URLs (public bucket or CDN) can go straight into cached pages, signed ones expire
+        return f"{self.public_base}/{self.key(name)}" if self.public_base else None
+
+
+def storage_from_env(default_root):
+    # STORAGE_BACKEND=s3 with S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL (MinIO, moto_server) and S3_PUBLIC_URL
+    if os.environ.get("STORAGE_BACKEND", "filesystem") == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", ""),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+            public_url=os.environ.get("S3_PUBLIC_URL"),
+            url_expires=int(os.environ.get("S3_URL_EXPIRES", 3600)),
+        )
+    return FileSystemStorage(os.environ.get("UPLOAD_FOLDER", default_root))
+
+
+class UploadServer:
+    """Serves stored uploads, offloading the bytes to the proxy or the object store when configured
+
+    UPLOAD_SERVE=app        the worker streams the file (default)
+    UPLOAD_SERVE=x-accel    nginx serves it from an internal location at UPLOAD_ACCEL_PREFIX
+    UPLOAD_SERVE=x-sendfile Apache/lighttpd serve the local path
+    UPLOAD_SERVE=redirect   302 to the object store URL
+    """
+
+    def __init__(self, storage, mode="app", accel_prefix="/_uploads"):
+        self.storage = storage
+        self.mode = mode
+        self.accel_prefix = accel_prefix.rstrip("/")
+
+    def url_for(self, name, endpoint_url):
+        # Straight to the bucket/CDN when that URL is stable, otherwise through the app route
+        return self.storage.public_url(name) or endpoint_url(name)
+
+    def _offloaded(self, header, value, name):
+        response = Response(status=200, mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        response.headers[header] = value
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+    def response(self, name):
+        if safe_join("", name) is None:
+            abort(404)
+
+        if self.mode == "redirect" or (self.mode != "app" and self.storage.local_path(name) is None):
+            url = self.storage.url(name)
+            if url:
+                return redirect(url)
+
+        local_path = self.storage.local_path(name)
+        if self.mode == "x-accel" and local_path:
+            return self._offloaded("X-Accel-Redirect", f"{self.accel_prefix}/{name}", name)
+        if self.mode == "x-sendfile" and local_path:
+            return self._offloaded("X-Sendfile", os.path.abspath(local_path), name)
+
+        if local_path:
+            if not os.path.isfile(local_path):
+                abort(404)
+            response = send_file(local_path, conditional=True)
+        else:
+            # Object store without offloading, the bytes pass through the worker in chunks
+            if not self.storage.exists(name):
+                abort(404)
+            body = self.storage.open(name)
+            response = Response(iter(lambda: body.read(CHUNK_SIZE), b""),
+                                mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream")
+            response.call_on_close(body.close)
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
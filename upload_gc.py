@@ -0,0 +1,153 @@
+import threading
+import time
+
+from sqlalchemy import select, delete
+
+from image_variants import remove_variants
+
+
+SWEEP_NAME = "uploads"
+
+
+class UploadGC:
+    """Deletes upload blobs that no ProjectImage points at, in bounded batches outside the request"""
+
+    def __init__(self, grace=3600, batch_size=200, interval=300):
+        self.grace = grace              # seconds a blob must be untouched, covers uploads not committed yet
+        self.batch_size = batch_size
+        self.interval = interval
+        self.reclaimed_files = 0
+        self.reclaimed_bytes = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db, image_model, pending_model, checkpoint_model, storage):
+        self.app = app
+        self.db = db
+        self.image_model = image_model
+        self.pending_model = pending_model
+        self.checkpoint_model = checkpoint_model
+        self.storage = storage
+
+    def defer(self, filenames):
+        """Queues released blobs in the caller's session, so they are committed with the rows that let go of them"""
+        for filename in filenames:
+            self.db.session.merge(self.pending_model(filename))
+
+    def _referenced(self, names):
+        return set(self.db.session.execute(
+            select(self.image_model.image_file).where(self.image_model.image_file.in_(names))
+        ).scalars())
+
+    def _collect(self, name, size, modified, dry_run):
+        """Deletes one unreferenced blob and its variants if it is past the grace period, returns the bytes freed"""
+        if modified > time.time() - self.grace:
+            return None
+        if dry_run:
+            return size
+
+        # The listing may be minutes old by now, save_upload can have reused the blob since. It touches the file
+        # before committing its row, so stat first and check the references last, right before the delete
+        stat = self.storage.stat(name)
+        if stat is None or stat[1] > time.time() - self.grace or self._referenced([name]):
+            return None
+        size = stat[0]
+        self.storage.delete(name)
+        return size + remove_variants(self.storage, name)
+
+    def process_pending(self, dry_run=False):
+        """One batch of queued deletions, returns (entries cleared from the queue, files, bytes)"""
+        files = freed = 0
+        pending = self.db.session.execute(
+            select(self.pending_model.filename).order_by(self.pending_model.queued_at).limit(self.batch_size)
+        ).scalars().all()
+        referenced = self._referenced(pending) if pending else set()
+
+        done = []
+        for name in pending:
+            stat = None if name in referenced else self.storage.stat(name)
+            if stat is not None:
+                reclaimed = self._collect(name, *stat, dry_run)
+                if reclaimed is None:
+                    continue   # touched recently, try again on a later run
+                files += 1
+                freed += reclaimed
+            done.append(name)   # deleted, referenced again or already gone
+
+        if done and not dry_run:
+            self.db.session.execute(delete(self.pending_model).where(self.pending_model.filename.in_(done)))
+        self.db.session.commit()
+        return len(done), files, freed
+
+    def sweep_batch(self, position=None, dry_run=False):
+        """Checks the next batch of stored blobs after position (default the saved checkpoint),
+        returns (scanned, files, bytes, next position), the next position is "" once the listing wrapped"""
+        checkpoint = self.db.session.get(self.checkpoint_model, SWEEP_NAME) or self.checkpoint_model(SWEEP_NAME)
+        if position is None:
+            position = checkpoint.position
+        entries = self.storage.listing(start_after=position, limit=self.batch_size)
+        referenced = self._referenced([name for name, _, _ in entries]) if entries else set()
+
+        files = freed = 0
+        for name, size, modified in entries:
+            if name in referenced:
+                continue
+            reclaimed = self._collect(name, size, modified, dry_run)
+            if reclaimed is not None:
+                files += 1
+                freed += reclaimed
+
+        # A short batch means the end of the listing, the next sweep starts from the beginning again
+        next_position = "" if len(entries) < self.batch_size else entries[-1][0]
+        if not dry_run:
+            checkpoint.position = next_position
+            self.db.session.add(checkpoint)
+        self.db.session.commit()
+        return len(entries), files, freed, next_position
+
+    def _record(self, files, freed):
+        with self._lock:
+            self.reclaimed_files += files
+            self.reclaimed_bytes += freed
+
+    def run_once(self):
+        """The queued deletions plus one sweep batch, what the background thread does every interval"""
+        with self.app.app_context():
+            _, pending_files, pending_bytes = self.process_pending()
+            _, swept_files, swept_bytes, _ = self.sweep_batch()
+        files, freed = pending_files + swept_files, pending_bytes + swept_bytes
+        self._record(files, freed)
+        if files:
+            self.app.logger.info(f"Upload GC removed {files} files, reclaimed {freed} bytes "
+                                 f"({self.reclaimed_bytes} since start)")
+        return files, freed
+
+    def collect_all(self, dry_run=False):
+        """Drains the queue and sweeps the whole store once from the start, returns (scanned, files, bytes)"""
+        scanned = files = freed = 0
+        # The sweep sees every queued blob too, a dry run leaves the queue alone so nothing is counted twice
+        while not dry_run:
+            cleared, batch_files, batch_bytes = self.process_pending()
+            files, freed = files + batch_files, freed + batch_bytes
+            if cleared < self.batch_size:
+                break
+
+        position = ""
+        while True:
+            batch_scanned, batch_files, batch_bytes, position = self.sweep_batch(position, dry_run)
+            scanned, files, freed = scanned + batch_scanned, files + batch_files, freed + batch_bytes
+            if not position:
+                break
+        if not dry_run:
+            self._record(files, freed)
+        return scanned, files, freed
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                self.app.logger.error(f"Upload GC failed: {e}")
+
+    def start(self):
+        threading.Thread(target=self._run, name="upload-gc", daemon=True).start()
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tempfile
+
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(digest, original_filename):
+    ext = os.path.splitext(secure_filename(original_filename))[1].lower() or ".bin"
+    return f"{digest}{ext}"
+
+
+def save_upload(file_storage, storage):
+    """Streams an upload to a temp file while hashing it and stores it once per content hash, returns the blob name"""
+
+    digest = hashlib.sha256()
+
+    # Written under a temp name first, the final name is only known once every chunk is hashed
+    fd, tmp_path = tempfile.mkstemp(dir=storage.staging_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+
+        filename = blob_name(digest.hexdigest(), file_storage.filename)
+        if storage.exists(filename):
+            os.remove(tmp_path)   # same bytes are already stored
+            storage.touch(filename)   # fresh again, so the upload GC's grace period covers the reuse
+        else:
+            storage.save_file(filename, tmp_path)
+        return filename
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dedupe_uploads(session, image_model, storage, release):
+    """Moves existing uploads to content-hash names and drops the byte-identical copies.
+    The old files go to release (the upload GC queue) with the renames, nothing is deleted before the commit"""
+
+    renamed, removed = 0, 0
+    released = set()
+    moved = {}   # old name -> blob name, for rows that shared a file
+    for image in session.execute(select(image_model)).scalars():
+        if image.image_file in moved:
+            image.image_file = moved[image.image_file]
+            image.width = image.height = image.variants = None
+            continue
+
+        if not storage.exists(image.image_file):
+            continue
+
+        digest = hashlib.sha256()
+        with storage.open(image.image_file) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+
+        filename = blob_name(digest.hexdigest(), image.image_file)
+        if filename == image.image_file:
+            continue
+
+        if storage.exists(filename):
+            removed += 1
+        else:
+            with storage.open(image.image_file) as f:
+                storage.save(filename, f)
+        released.add(image.image_file)
+
+        moved[image.image_file] = filename
+        image.image_file = filename
+        image.width = image.height = image.variants = None   # rebuilt under the new name
+        renamed += 1
+
+    release(released)
+    session.commit()
+    return renamed, removed